@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 from uuid import UUID
 
 
@@ -6,6 +7,9 @@ from uuid import UUID
 class QueueInfo:
     name: str
     durable: bool = True
+    # messages in flight for the whole queue, None follows the worker prefetch count
+    prefetch_count: Optional[int] = None
+    channels: int = 1
 
     def __hash__(self):
         return hash(self.name)
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+from asyncio import AbstractEventLoop
+
+from fm_url_checker.consumer.amqp.models import ConnectionArgs
+
+log = logging.getLogger(__name__)
+
+
+class BrokerUnavailable(Exception):
+    pass
+
+
+async def probe_broker(connection_args: ConnectionArgs, timeout: float = 1) -> bool:
+    """ Checks whether the broker accepts TCP connections, without doing the AMQP handshake """
+
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host=connection_args.host,
+                                                                   port=connection_args.port),
+                                           timeout=timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+async def wait_for_broker(connection_args: ConnectionArgs,
+                          initial_delay: float = 0.1,
+                          max_delay: float = 5,
+                          timeout: float = 60,
+                          loop: AbstractEventLoop = None) -> float:
+    """
+    Probes the broker with an exponential back-off until it is reachable.
+    Returns the time spent waiting, raises BrokerUnavailable once the timeout is exceeded.
+    """
+
+    loop = loop or asyncio.get_event_loop()
+    started = loop.time()
+    delay = initial_delay
+    attempt = 1
+    while not await probe_broker(connection_args, timeout=max(delay, 1)):
+        elapsed = loop.time() - started
+        if elapsed + delay > timeout:
+            raise BrokerUnavailable(f"Broker {connection_args.host}:{connection_args.port} "
+                                    f"unreachable after {attempt} attempts ({elapsed:.2f}s)")
+        log.info(f"Broker not ready, retrying in {delay:.2f}s", extra={"attempt": attempt})
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+        attempt += 1
+
+    waited = loop.time() - started
+    log.info(f"Broker ready after {attempt} attempts ({waited:.2f}s)")
+    return waited
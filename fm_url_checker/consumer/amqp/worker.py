@@ -1,23 +1,31 @@
 import asyncio
 import logging
 from asyncio import AbstractEventLoop, Task
-from typing import Set, Callable, Coroutine
+from typing import Set, Callable, Coroutine, List, Dict, Optional
 
 import aio_pika
-from aio_pika import Channel, Queue, IncomingMessage
+from aio_pika import Channel, Queue, IncomingMessage, Message
 from aio_pika.robust_connection import RobustConnection
 
 from fm_url_checker.consumer.amqp.models import ConnectionArgs, QueueInfo
+from fm_url_checker.consumer.amqp.probe import wait_for_broker
 
 log = logging.getLogger(__name__)
 
 
 class BaseTask:
     def __init__(self, loop: AbstractEventLoop = None):
-        self._loop = loop or asyncio.get_event_loop()
+        self.__loop = loop
         self._task: Task = None
         self._stopped = False
 
+    @property
+    def _loop(self) -> AbstractEventLoop:
+        # resolved lazily so module level tasks pick up the loop (and policy) set up by run()
+        if self.__loop is None:
+            self.__loop = asyncio.get_event_loop()
+        return self.__loop
+
     async def start(self):
         self._task = self._loop.create_task(self.main_loop())
 
@@ -30,18 +38,65 @@ class BaseTask:
         raise NotImplementedError
 
 
-class Worker(BaseTask):
+class BaseWorker(BaseTask):
+    """
+    Transport used by the consumers, delivers the messages of the registered queues to their callbacks as
+    IncomingMessage (or an object with the same interface) and publishes to the queues.
+    """
+
+    @property
+    def prefetch_count(self) -> int:
+        raise NotImplementedError
+
+    async def set_prefetch(self, prefetch_count: int) -> None:
+        raise NotImplementedError
+
+    @property
+    def ready(self) -> bool:
+        raise NotImplementedError
+
+    async def register_queue(self, queue_info: QueueInfo, callback: Callable[[IncomingMessage], Coroutine]):
+        raise NotImplementedError
+
+    async def publish(self, routing_key: str, body: bytes, headers: dict = None, exchange: str = "") -> None:
+        raise NotImplementedError
+
+    async def main_loop(self):
+        pass
+
+
+class Worker(BaseWorker):
+    """ AMQP transport, on robust connections to RabbitMQ """
+
     def __init__(self,
                  connection_args: ConnectionArgs,
                  prefetch_count: int = 1,
                  prefetch_size: int = 0,
+                 startup_timeout: float = 60,
+                 probe_max_delay: float = 5,
+                 reconnect_delay: float = 1,
+                 connections: int = 1,
                  loop: AbstractEventLoop = None):
         self._queues: Set[QueueInfo] = set()
         self._connection_args = connection_args
-        self._connection: RobustConnection = None
+        self._connection_count = max(1, connections)
+        self._connections: List[RobustConnection] = []
+        # publishing and declarations, consumers get channels of their own in register_queue
         self._channel: Channel = None
+        self._queue_channels: Dict[str, List[Channel]] = {}
+        # the queue declared on each of its channels and the consumer tag, None while the channel doesn't consume
+        self._queue_consumers: Dict[str, List[Queue]] = {}
+        self._consumer_tags: Dict[str, List[Optional[str]]] = {}
+        self._queue_callbacks: Dict[str, Callable[[IncomingMessage], Coroutine]] = {}
+        self._next_connection = 0
         self._prefetch_count = prefetch_count
+        # latest requested by set_prefetch, applied under the QoS lock
+        self._prefetch_target = prefetch_count
+        self._qos_lock: asyncio.Lock = None
         self._prefetch_size = prefetch_size
+        self._startup_timeout = startup_timeout
+        self._probe_max_delay = probe_max_delay
+        self._reconnect_delay = reconnect_delay
         self._connection_task: Task = None
 
         self._close_connection_triggered = False
@@ -50,16 +105,42 @@ class Worker(BaseTask):
     async def start(self) -> None:
         log.info("Starting worker")
         await self.connect()
-        await self._channel.set_qos(prefetch_size=self._prefetch_size,
-                                    prefetch_count=self._prefetch_count)
         await super().start()
 
     async def stop(self):
-        if self._connection:
+        if self._connections:
             self._close_connection_triggered = True
-            await self._connection.close()
+            await asyncio.gather(*[connection.close() for connection in self._connections])
         await super().stop()
 
+    @property
+    def prefetch_count(self) -> int:
+        return self._prefetch_count
+
+    async def set_prefetch(self, prefetch_count: int) -> None:
+        """
+        Changes the QoS of the queues following the worker prefetch count at runtime,
+        unacked messages over the new limit are kept
+        """
+
+        self._prefetch_target = prefetch_count
+        async with self._qos():
+            # calls overlap (memory pressure and concurrency limit), the last requested count wins
+            prefetch_count = self._prefetch_target
+            if prefetch_count == self._prefetch_count:
+                return
+            log.info(f"Changing prefetch count from {self._prefetch_count} to {prefetch_count}")
+            self._prefetch_count = prefetch_count
+            for queue_info in self._queues:
+                if queue_info.prefetch_count is None:
+                    await self._set_qos(queue_info)
+
+    @property
+    def ready(self) -> bool:
+        return (self._channel is not None and not self._channel.is_closed
+                and all(not connection.is_closed for connection in self._connections)
+                and not self._close_connection_triggered)
+
     async def register_worker(self):
         await self.connect()
 
@@ -79,34 +160,113 @@ class Worker(BaseTask):
         else:
             log.warning(f"Reacquired connection to broker after clean connection close: {connection}")
 
+    async def _open_connection(self) -> RobustConnection:
+        connection: RobustConnection = await aio_pika.connect_robust(**self._connection_args.__dict__,
+                                                                     retry_delay=self._reconnect_delay,
+                                                                     connection_attempts=5,
+                                                                     socket_timeout=1)
+        # robust connections restore their channels, QoS and consumers on their own after a reconnect
+        connection.add_connection_lost_callback(callback=self.connection_lost)
+        connection.add_close_callback(callback=self.connection_closed)
+        connection.add_reconnect_callback(callback=self.connection_reconnected)
+        return connection
+
     async def _connect_channel(self) -> Channel:
-        log.info("Connecting worker")
-        self._connection: RobustConnection = await aio_pika.connect_robust(**self._connection_args.__dict__,
-                                                                           retry_delay=10,
-                                                                           connection_attempts=5,
-                                                                           socket_timeout=1)
-        self._connection.add_connection_lost_callback(callback=self.connection_lost)
-        self._connection.add_close_callback(callback=self.connection_closed)
-        self._connection.add_reconnect_callback(callback=self.connection_reconnected)
-        return await self._connection.channel()
+        log.info(f"Connecting worker using {self._connection_count} connection(s)")
+        await wait_for_broker(self._connection_args,
+                              max_delay=self._probe_max_delay,
+                              timeout=self._startup_timeout,
+                              loop=self._loop)
+        self._connections = list(await asyncio.gather(*[self._open_connection()
+                                                        for _ in range(self._connection_count)]))
+        return await self._connections[0].channel()
 
     async def connect(self) -> None:
+        if self._channel is not None and not self._channel.is_closed:
+            return
         connected = False
-        if not self._connection_task and (not self._channel or not self._channel.is_open):
+        if not self._connection_task:
             connected = True
             self._connection_task: Task = self._loop.create_task(self._connect_channel())
-        self._channel = await self._connection_task
+        try:
+            self._channel = await self._connection_task
+        finally:
+            # a failed attempt is not reused by the next connect()
+            if connected:
+                self._connection_task = None
         if connected:
-            log.info(f"Connected to broker: {self._connection}")
-        self._connection_task = None
+            log.info(f"Connected to broker: {self._connections[0]}")
+
+    def _next_channel(self) -> Coroutine:
+        """ Opens a channel on the next connection, round robin """
+
+        connection = self._connections[self._next_connection % len(self._connections)]
+        self._next_connection += 1
+        return connection.channel()
+
+    def _qos(self) -> asyncio.Lock:
+        """ Held for a whole QoS update, _set_qos awaits the broker between reading and writing the consumer tags """
+
+        if self._qos_lock is None:
+            self._qos_lock = asyncio.Lock()
+        return self._qos_lock
+
+    @staticmethod
+    def _split_prefetch(total: int, channels: int) -> List[int]:
+        """ Splits the prefetch count exactly, the remainder goes to the first channels """
+
+        base, remainder = divmod(total, channels)
+        return [base + 1 if i < remainder else base for i in range(channels)]
+
+    async def _set_qos(self, queue_info: QueueInfo) -> None:
+        """
+        Splits the queue prefetch count over its channels. Channels left without a share stop consuming, a prefetch
+        count of 0 would mean unlimited.
+        """
+
+        channels = self._queue_channels.get(queue_info.name, [])
+        if not channels:
+            return
+        queues = self._queue_consumers[queue_info.name]
+        tags = self._consumer_tags[queue_info.name]
+        total = self._prefetch_count if queue_info.prefetch_count is None else queue_info.prefetch_count
+        # an unlimited queue stays unlimited on every channel
+        shares = self._split_prefetch(total, len(channels)) if total else [0] * len(channels)
+        for i, (channel, queue, share) in enumerate(zip(channels, queues, shares)):
+            if channel.is_closed:
+                continue
+            if share or not total:
+                # QoS before consuming, so the broker does not push more than the limit on the first delivery
+                await channel.set_qos(prefetch_size=self._prefetch_size, prefetch_count=share)
+                if tags[i] is None:
+                    # noinspection PyTypeChecker
+                    tags[i] = await queue.consume(callback=self._queue_callbacks[queue_info.name])
+            elif tags[i] is not None:
+                # unacked messages of the channel are kept until they are settled
+                await queue.cancel(tags[i])
+                tags[i] = None
 
     async def register_queue(self, queue_info: QueueInfo, callback: Callable[[IncomingMessage], Coroutine]):
+        """ Consumes the queue on queue_info.channels channels of its own, spread over the worker connections """
+
         await self.connect()
         self._queues.add(queue_info)
-        queue: Queue = await self._channel.declare_queue(name=queue_info.name,
-                                                         durable=queue_info.durable)
-        # noinspection PyTypeChecker
-        await queue.consume(callback=callback)
+        channels = [await self._next_channel() for _ in range(max(1, queue_info.channels))]
+        self._queue_channels[queue_info.name] = channels
+        self._queue_consumers[queue_info.name] = [await channel.declare_queue(name=queue_info.name,
+                                                                              durable=queue_info.durable)
+                                                  for channel in channels]
+        self._consumer_tags[queue_info.name] = [None] * len(channels)
+        self._queue_callbacks[queue_info.name] = callback
+        async with self._qos():
+            await self._set_qos(queue_info)
+        log.info(f"Consuming {queue_info.name} on {len(channels)} channel(s)")
 
-    async def main_loop(self):
-        pass
+    async def publish(self, routing_key: str, body: bytes, headers: dict = None, exchange: str = "") -> None:
+        await self.connect()
+        target = await self._channel.get_exchange(exchange) if exchange else self._channel.default_exchange
+        await target.publish(Message(body=body,
+                                     content_type="application/json",
+                                     content_encoding="utf8",
+                                     headers=headers or {}),
+                             routing_key=routing_key)
@@ -0,0 +1,125 @@
+"""
+Runs the consumer fetch path against a local server whose capacity and latency shift between phases and prints how
+the adaptive concurrency limit follows them.
+
+    python fm_url_checker/consumer/benchmarks/adaptive_concurrency.py
+
+The server runs in a process of its own, sharing the event loop its CPU time would show up as target latency.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+from uuid import uuid4
+
+from aiohttp import ClientSession, web
+
+from fm_url_checker.consumer import concurrency, url_check
+from fm_url_checker.consumer.models import Job
+
+# (duration in seconds, server side concurrency, latency in seconds)
+PHASES = [
+    (20, 32, 0.1),
+    (20, 8, 0.2),
+    (20, 64, 0.1),
+]
+
+
+class ShiftingServer:
+    """ Serves `capacity` requests at a time with a fixed latency, anything over it queues up """
+
+    def __init__(self):
+        self.capacity = 1
+        self.latency = 0.0
+        self.semaphore = asyncio.Semaphore(1)
+
+    def shift(self, capacity: int, latency: float) -> None:
+        self.capacity, self.latency = capacity, latency
+        self.semaphore = asyncio.Semaphore(capacity)
+
+    async def handler(self, request: web.Request) -> web.Response:
+        async with self.semaphore:
+            await asyncio.sleep(self.latency)
+        return web.Response(text="ok")
+
+    async def shift_handler(self, request: web.Request) -> web.Response:
+        self.shift(int(request.query["capacity"]), float(request.query["latency"]))
+        return web.Response(text="ok")
+
+
+def serve(port: multiprocessing.Value) -> None:
+    async def start():
+        server = ShiftingServer()
+        app = web.Application()
+        app.router.add_get("/", server.handler)
+        app.router.add_post("/shift", server.shift_handler)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host="127.0.0.1", port=0).start()
+        port.value = runner.addresses[0][1]
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start())
+    loop.run_forever()
+
+
+async def main(ceiling: int, interval: float, tolerance: float, probe_every: int) -> None:
+    port = multiprocessing.Value("i", 0)
+    server = multiprocessing.Process(target=serve, args=(port,), daemon=True)
+    server.start()
+    while not port.value:
+        await asyncio.sleep(0.05)
+    url = f"http://127.0.0.1:{port.value}/"
+
+    controller = concurrency.ConcurrencyController(floor=1,
+                                                   ceiling=ceiling,
+                                                   initial=1,
+                                                   interval=interval,
+                                                   tolerance=tolerance,
+                                                   probe_every=probe_every)
+    concurrency.controller = controller
+    await controller.start()
+
+    completed = 0
+    stopped = False
+
+    async def consumer():
+        nonlocal completed
+        while not stopped:
+            await url_check._process_job(Job(id=uuid4().hex, url=url))
+            completed += 1
+
+    consumers = [asyncio.ensure_future(consumer()) for _ in range(ceiling)]
+
+    print(f"{'t':>4} {'capacity':>8} {'latency':>8} {'limit':>5} {'in_flight':>9} {'avg_ms':>7} {'jobs/s':>7}")
+    started = time.monotonic()
+    for duration, capacity, latency in PHASES:
+        async with ClientSession() as session:
+            await session.post(f"{url}shift", params={"capacity": capacity, "latency": latency})
+        for _ in range(duration):
+            before = completed
+            await asyncio.sleep(1)
+            info = controller.info()
+            print(f"{time.monotonic() - started:4.0f} {capacity:8d} {latency * 1000:6.0f}ms {info['limit']:5d} "
+                  f"{info['in_flight']:9d} {info.get('latency', 0) * 1000:7.1f} {completed - before:7d}")
+
+    stopped = True
+    await asyncio.gather(*consumers)
+    await controller.stop()
+    server.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ceiling", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.5, help="controller adjust interval in seconds")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="accepted latency inflation over the baseline")
+    parser.add_argument("--probe-every", type=int, default=20, help="adjust intervals between baseline probes")
+    args = parser.parse_args()
+
+    logging.getLogger("").setLevel("WARNING")
+    asyncio.get_event_loop().run_until_complete(main(ceiling=args.ceiling,
+                                                         interval=args.interval,
+                                                         tolerance=args.tolerance,
+                                                         probe_every=args.probe_every))
@@ -0,0 +1,113 @@
+"""
+Compares the job latency of the transports: the time the API request waits for the publish and the time until the
+consumer callback gets the message, one message at a time so only the transport is measured.
+
+    python fm_url_checker/consumer/benchmarks/transport_latency.py --messages 2000
+
+Publishes go through the producer's code paths from a thread, as under uwsgi: AmqpTransport (a connection per job)
+against the RABBITMQ_* broker, skipped if it isn't reachable, and the EmbeddedTransport hand-off to the event loop,
+in memory and with a journal.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import tempfile
+import time
+from typing import Callable, Dict, List
+from uuid import uuid4
+
+from fm_url_checker.consumer import settings
+from fm_url_checker.consumer.amqp.models import ConnectionArgs, QueueInfo
+from fm_url_checker.consumer.amqp.probe import probe_broker
+from fm_url_checker.consumer.amqp.worker import BaseWorker, Worker
+from fm_url_checker.consumer.embedded.worker import EmbeddedWorker
+from fm_url_checker.producer import transport
+
+QUEUE = "transport-latency-benchmark"
+PERCENTILES = (50, 90, 99, 100)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * percent / 100) - 1)]
+
+
+async def measure(worker: BaseWorker, publish: Callable[[], None], messages: int, warmup: int) -> Dict[str, List]:
+    loop = asyncio.get_event_loop()
+    delivered: asyncio.Queue = asyncio.Queue()
+
+    async def callback(message):
+        delivered.put_nowait(time.perf_counter())
+        message.ack()
+
+    await worker.register_queue(QueueInfo(name=QUEUE, durable=False), callback)
+    timings = {"publish": [], "delivery": []}
+    for i in range(warmup + messages):
+        started = time.perf_counter()
+        await loop.run_in_executor(None, publish)
+        published = time.perf_counter()
+        received = await asyncio.wait_for(delivered.get(), 10)
+        if i >= warmup:
+            timings["publish"].append(published - started)
+            timings["delivery"].append(received - started)
+    return timings
+
+
+def embedded_publish(worker: EmbeddedWorker, loop: asyncio.AbstractEventLoop) -> Callable[[], None]:
+    # what EmbeddedTransport.publish does
+    def publish():
+        asyncio.run_coroutine_threadsafe(worker.publish(routing_key=QUEUE,
+                                                        body=json.dumps({"url": "https://example.com"}).encode("utf8"),
+                                                        headers={"job_id": uuid4().hex}),
+                                         loop).result()
+    return publish
+
+
+def amqp_publish() -> None:
+    transport.AmqpTransport().publish(routing_key=QUEUE, body={"url": "https://example.com"},
+                                      headers={"job_id": uuid4().hex})
+
+
+async def main(messages: int, warmup: int) -> None:
+    loop = asyncio.get_event_loop()
+    print(f"{'transport':<18} {'':>8} " + " ".join(f"{f'p{p}' if p < 100 else 'max':>8}" for p in PERCENTILES))
+
+    def report(name: str, timings: Dict[str, List]) -> None:
+        for kind, values in timings.items():
+            print(f"{name:<18} {kind:>8} " + " ".join(f"{percentile(values, p) * 1000:6.2f}ms" for p in PERCENTILES))
+
+    worker = EmbeddedWorker(prefetch_count=1)
+    await worker.start()
+    report("embedded", await measure(worker, embedded_publish(worker, loop), messages, warmup))
+    await worker.stop()
+
+    with tempfile.TemporaryDirectory() as journal_dir:
+        worker = EmbeddedWorker(prefetch_count=1, journal_dir=journal_dir)
+        await worker.start()
+        report("embedded+journal", await measure(worker, embedded_publish(worker, loop), messages, warmup))
+        await worker.stop()
+
+    connection_args = ConnectionArgs(host=settings.RABBITMQ_HOST,
+                                     port=settings.RABBITMQ_PORT,
+                                     login=settings.RABBITMQ_USER,
+                                     password=settings.RABBITMQ_PASS,
+                                     virtualhost=settings.RABBITMQ_VHOST)
+    if not await probe_broker(connection_args):
+        print(f"{'amqp':<18} skipped, no broker on {settings.RABBITMQ_HOST}:{settings.RABBITMQ_PORT}")
+        return
+    worker = Worker(connection_args=connection_args, prefetch_count=1)
+    await worker.start()
+    report("amqp", await measure(worker, amqp_publish, messages, warmup))
+    await worker.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000, help="measured messages per transport")
+    parser.add_argument("--warmup", type=int, default=100, help="messages sent before measuring")
+    args = parser.parse_args()
+
+    logging.getLogger("").setLevel("WARNING")
+    asyncio.get_event_loop().run_until_complete(main(messages=args.messages, warmup=args.warmup))
@@ -0,0 +1,93 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+from fm_url_checker.consumer import settings
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Circuit:
+    failures: int = 0
+    opened_at: float = None
+
+
+class CircuitBreaker:
+    """
+    Per host circuit breaker for connection level failures.
+
+    A host's circuit opens after `threshold` consecutive failures, while open checks fail fast without touching the
+    network. Once `reset_timeout` passes a single check is let through as a probe (half open), a success closes the
+    circuit and a failure keeps it open for another `reset_timeout`. Only failing hosts are tracked, in an LRU capped
+    at `max_hosts`.
+    """
+
+    def __init__(self,
+                 threshold: int = 5,
+                 reset_timeout: float = 30,
+                 max_hosts: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._max_hosts = max_hosts
+        self._clock = clock
+        self._circuits: Dict[str, Circuit] = OrderedDict()
+        self.short_circuited = 0
+        self.opened = 0
+        self.probes = 0
+
+    def is_open(self, host: str) -> bool:
+        circuit = self._circuits.get(host)
+        return circuit is not None and circuit.opened_at is not None
+
+    def allow(self, host: str) -> bool:
+        circuit = self._circuits.get(host)
+        if circuit is None or circuit.opened_at is None:
+            return True
+
+        now = self._clock()
+        if now - circuit.opened_at >= self._reset_timeout:
+            # half open, re-arm so only this check probes the host
+            circuit.opened_at = now
+            self.probes += 1
+            log.info("Probing unavailable host", extra={"host": host})
+            return True
+
+        self.short_circuited += 1
+        return False
+
+    def record_success(self, host: str) -> None:
+        circuit = self._circuits.pop(host, None)
+        if circuit is not None and circuit.opened_at is not None:
+            log.info("Host available again, closing circuit", extra={"host": host})
+
+    def record_failure(self, host: str) -> None:
+        circuit = self._circuits.pop(host, None) or Circuit()
+        self._circuits[host] = circuit
+        if len(self._circuits) > self._max_hosts:
+            self._circuits.popitem(last=False)
+
+        circuit.failures += 1
+        if circuit.opened_at is not None:
+            circuit.opened_at = self._clock()
+        elif circuit.failures >= self._threshold:
+            circuit.opened_at = self._clock()
+            self.opened += 1
+            log.warning(f"Host unavailable after {circuit.failures} failures, opening circuit", extra={"host": host})
+
+    def info(self) -> Dict[str, int]:
+        return {
+            "tracked_hosts": len(self._circuits),
+            "open": sum(1 for circuit in self._circuits.values() if circuit.opened_at is not None),
+            "opened": self.opened,
+            "short_circuited": self.short_circuited,
+            "probes": self.probes,
+        }
+
+
+breaker = CircuitBreaker(threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+                         reset_timeout=settings.CIRCUIT_RESET_TIMEOUT,
+                         max_hosts=settings.CIRCUIT_MAX_HOSTS)
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import math
+from asyncio import AbstractEventLoop
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, List, Union
+
+from fm_url_checker.consumer import settings
+from fm_url_checker.consumer.amqp.worker import BaseTask
+
+log = logging.getLogger(__name__)
+
+
+class ConcurrencyController(BaseTask):
+    """
+    Gradient based concurrency limit.
+
+    Every interval the average fetch latency is compared to a baseline, the fastest fetch seen over the last
+    `baseline_window` intervals. The limit grows by a sqrt(limit) headroom while latency stays within `tolerance` of
+    the baseline and fewer than sqrt(limit) fetches are estimated to queue at the target, it shrinks by their ratio
+    once latency exceeds the tolerance. An error rate or event loop lag above their thresholds backs off the limit
+    multiplicatively instead. The limit only grows while it's actually being used and always stays within
+    [floor, ceiling].
+
+    Under queueing every fetch is slow, so the baseline is frozen while latency is inflated and only rises by at most
+    `baseline_drift` per interval otherwise. A target that really got slower is picked up by a probe every
+    `probe_every` intervals: the limit drops to the floor until the requests in flight drained, the fastest fetch of
+    the next interval becomes the new baseline and the previous limit is restored.
+    """
+
+    def __init__(self,
+                 floor: int = 1,
+                 ceiling: int = 100,
+                 initial: int = None,
+                 interval: float = 1,
+                 tolerance: float = 1.5,
+                 smoothing: float = 0.2,
+                 max_error_rate: float = 0.2,
+                 max_loop_lag: float = 0.1,
+                 backoff: float = 0.7,
+                 baseline_window: int = 10,
+                 baseline_drift: float = 0.1,
+                 probe_every: int = 60,
+                 loop: AbstractEventLoop = None):
+        if not 1 <= floor <= ceiling:
+            raise ValueError("Expecting 1 <= floor <= ceiling")
+        self.floor = floor
+        self.ceiling = ceiling
+        self._limit = float(min(max(initial or floor, floor), ceiling))
+        self._interval = interval
+        self._tolerance = tolerance
+        self._smoothing = smoothing
+        self._max_error_rate = max_error_rate
+        self._max_loop_lag = max_loop_lag
+        self._backoff = backoff
+
+        self.in_flight = 0
+        self._peak_in_flight = 0
+        self._latencies: List[float] = []
+        self._errors = 0
+        self._min_latencies: Deque[float] = deque(maxlen=baseline_window)
+        self._baseline: float = None
+        self._baseline_drift = baseline_drift
+        self._probe_every = probe_every
+        self._intervals = 0
+        # limit to restore once the running probe measured the baseline
+        self._probe_restore: float = None
+        self.probes = 0
+        self.loop_lag = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self._last_info: Dict[str, float] = {}
+        self._condition: asyncio.Condition = None
+        self._callbacks: List[Callable[[int], None]] = []
+        super().__init__(loop=loop)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def add_limit_callback(self, callback: Callable[[int], None]) -> None:
+        self._callbacks.append(callback)
+
+    @asynccontextmanager
+    async def slot(self):
+        """ Holds one of the `limit` in-flight slots for the duration of the block """
+
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            async with self._condition:
+                self._condition.notify()
+
+    def record(self, latency: float, error: bool = False) -> None:
+        self._latencies.append(latency)
+        if error:
+            self._errors += 1
+
+    def adjust(self) -> None:
+        """ Computes the new limit from the samples recorded since the last call """
+
+        samples = len(self._latencies)
+        peak_in_flight, self._peak_in_flight = self._peak_in_flight, self.in_flight
+        if not samples:
+            return
+
+        short = sum(self._latencies) / samples
+        fastest = min(self._latencies)
+        error_rate = self._errors / samples
+        self._latencies = []
+        self._errors = 0
+
+        if self._probe_restore is not None:
+            if peak_in_flight > self.limit:
+                # fetches started before the probe are still queued at the target
+                return
+            self._baseline = fastest
+            self._min_latencies.clear()
+            self._min_latencies.append(fastest)
+            log.debug(f"Probed baseline latency {fastest:.4f}")
+            self._set_limit(self._probe_restore)
+            self._probe_restore = None
+            return
+
+        self._min_latencies.append(fastest)
+        if self._baseline is None:
+            self._baseline = fastest
+        elif short > self._tolerance * self._baseline:
+            # queueing inflates every sample, a new minimum is all that can be trusted
+            self._baseline = min(self._baseline, fastest)
+        else:
+            self._baseline = min(min(self._min_latencies), self._baseline * (1 + self._baseline_drift))
+        baseline = self._baseline
+
+        limit = self._limit
+        if error_rate > self._max_error_rate or self.loop_lag > self._max_loop_lag:
+            new_limit = limit * self._backoff
+        else:
+            gradient = max(0.5, min(1.0, self._tolerance * baseline / short))
+            # the headroom only while within tolerance, shrinking with it settles at twice the capacity of slow targets
+            new_limit = limit * gradient if gradient < 1 else limit + math.sqrt(limit)
+            # fetches queued at the target beyond what the baseline latency accounts for
+            queued = limit * (1 - baseline / short)
+            if new_limit > limit and peak_in_flight < self.limit:
+                # not using the current limit, growing it wouldn't tell us anything
+                new_limit = limit
+            elif new_limit > limit and queued > math.sqrt(limit):
+                # past the target's capacity, growing further would only queue more
+                new_limit = limit
+            elif new_limit < limit:
+                # shrink gradually, a single slow window shouldn't collapse the limit
+                new_limit = max(limit * (1 - self._smoothing) + new_limit * self._smoothing, limit * self._backoff)
+
+        self._last_info = {"latency": round(short, 4),
+                           "baseline_latency": round(baseline, 4),
+                           "error_rate": round(error_rate, 4)}
+        self._set_limit(new_limit)
+
+        self._intervals += 1
+        if self._probe_every and self._intervals % self._probe_every == 0 and self.limit > self.floor:
+            self.probes += 1
+            self._probe_restore = self._limit
+            self._set_limit(self.floor)
+
+    def _set_limit(self, new_limit: float) -> None:
+        previous = self.limit
+        self._limit = min(max(new_limit, self.floor), self.ceiling)
+        if self.limit != previous:
+            if self.limit > previous:
+                self.increases += 1
+            else:
+                self.decreases += 1
+            log.debug(f"Concurrency limit {previous} -> {self.limit}", extra=self._last_info)
+            for callback in self._callbacks:
+                callback(self.limit)
+            if self._condition is not None:
+                self._loop.create_task(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def main_loop(self):
+        while not self._stopped:
+            started = self._loop.time()
+            await asyncio.sleep(self._interval)
+            self.loop_lag = max(0.0, self._loop.time() - started - self._interval)
+            self.adjust()
+
+    def info(self) -> Dict[str, Union[int, float]]:
+        return {
+            "limit": self.limit,
+            "floor": self.floor,
+            "ceiling": self.ceiling,
+            "in_flight": self.in_flight,
+            "loop_lag": round(self.loop_lag, 4),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "probes": self.probes,
+            **self._last_info,
+        }
+
+
+controller = ConcurrencyController(floor=settings.CONCURRENCY_FLOOR,
+                                   ceiling=settings.CONCURRENCY_CEILING,
+                                   initial=settings.RABBITMQ_PREFETCH_COUNT,
+                                   interval=settings.CONCURRENCY_ADJUST_INTERVAL,
+                                   tolerance=settings.CONCURRENCY_LATENCY_TOLERANCE,
+                                   max_error_rate=settings.CONCURRENCY_MAX_ERROR_RATE,
+                                   max_loop_lag=settings.CONCURRENCY_MAX_LOOP_LAG,
+                                   probe_every=settings.CONCURRENCY_PROBE_EVERY)
@@ -0,0 +1,78 @@
+import base64
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+
+log = logging.getLogger(__name__)
+
+# message id -> (headers, body)
+Messages = Dict[int, Tuple[dict, bytes]]
+
+
+class QueueJournal:
+    """
+    Append-only journal of an embedded queue.
+
+    Every change is a single line, `P<tab>id<tab>headers<tab>body` when a message is published (json headers, base64
+    body) and `A<tab>id` once it is acked or dropped. The journal is replayed on load and rewritten as a snapshot of the
+    pending messages by `compact`, so it only grows with the traffic since the last compaction.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file = None
+
+    def load(self) -> Messages:
+        messages: Messages = OrderedDict()
+        if not os.path.exists(self._path):
+            return messages
+
+        with open(self._path, encoding="utf8") as journal:
+            for line_no, line in enumerate(journal, start=1):
+                parts = line.rstrip("\n").split("\t")
+                try:
+                    if parts[0] == "P":
+                        messages[int(parts[1])] = (json.loads(parts[2]), base64.b64decode(parts[3], validate=True))
+                    elif parts[0] == "A":
+                        messages.pop(int(parts[1]), None)
+                    else:
+                        raise ValueError(f"unknown record type {parts[0]}")
+                except (IndexError, ValueError) as e:
+                    # a crash mid-write can only truncate the last line
+                    log.warning(f"Skipping malformed journal line {line_no}: {e}")
+        return messages
+
+    def compact(self, messages: Iterable[Tuple[int, dict, bytes]]) -> None:
+        """ Atomically replaces the journal with a snapshot of the given pending messages """
+
+        self.close()
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as snapshot:
+            for message_id, headers, body in messages:
+                snapshot.write(self._published(message_id, headers, body))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(tmp_path, self._path)
+
+    @staticmethod
+    def _published(message_id: int, headers: dict, body: bytes) -> str:
+        return f"P\t{message_id}\t{json.dumps(headers)}\t{base64.b64encode(body).decode('ascii')}\n"
+
+    def _append(self, line: str) -> None:
+        if self._file is None:
+            self._file = open(self._path, "a", encoding="utf8")
+        self._file.write(line)
+        self._file.flush()
+
+    def publish(self, message_id: int, headers: dict, body: bytes) -> None:
+        self._append(self._published(message_id, headers, body))
+
+    def ack(self, message_id: int) -> None:
+        self._append(f"A\t{message_id}\n")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
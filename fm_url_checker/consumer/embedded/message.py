@@ -0,0 +1,57 @@
+from typing import TYPE_CHECKING, Any, Dict
+
+from aio_pika.exceptions import MessageProcessError
+
+if TYPE_CHECKING:
+    from fm_url_checker.consumer.embedded.worker import EmbeddedQueue
+
+
+class EmbeddedMessage:
+    """ Delivery from an embedded queue, with the part of aio_pika's IncomingMessage interface the consumers use """
+
+    def __init__(self,
+                 queue: "EmbeddedQueue",
+                 message_id: int,
+                 delivery_tag: int,
+                 headers: dict,
+                 body: bytes,
+                 redelivered: bool = False,
+                 content_type: str = "application/json",
+                 content_encoding: str = "utf8"):
+        self._queue = queue
+        self.message_id = message_id
+        self.delivery_tag = delivery_tag
+        self.headers = headers
+        self.body = body
+        self.redelivered = redelivered
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.exchange = ""
+        self.routing_key = queue.name
+        self.processed = False
+
+    def info(self) -> Dict[str, Any]:
+        return {"body_size": len(self.body),
+                "headers": self.headers,
+                "content_type": self.content_type,
+                "content_encoding": self.content_encoding,
+                "message_id": str(self.message_id),
+                "delivery_tag": self.delivery_tag,
+                "exchange": self.exchange,
+                "redelivered": self.redelivered,
+                "routing_key": self.routing_key}
+
+    def _settle(self, requeue: bool) -> None:
+        if self.processed:
+            raise MessageProcessError("Message already processed")
+        self.processed = True
+        self._queue.settle(self, requeue=requeue)
+
+    def ack(self, multiple: bool = False) -> None:
+        self._settle(requeue=False)
+
+    def reject(self, requeue: bool = False) -> None:
+        self._settle(requeue=requeue)
+
+    def nack(self, multiple: bool = False, requeue: bool = True) -> None:
+        self._settle(requeue=requeue)
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+from asyncio import AbstractEventLoop, Task
+from collections import deque
+from typing import Callable, Coroutine, Deque, Dict, List, Set, Tuple
+
+from fm_url_checker.consumer.amqp.models import QueueInfo
+from fm_url_checker.consumer.amqp.worker import BaseWorker
+from fm_url_checker.consumer.embedded.journal import QueueJournal
+from fm_url_checker.consumer.embedded.message import EmbeddedMessage
+
+log = logging.getLogger(__name__)
+
+
+class EmbeddedQueue:
+    """
+    In memory queue with the delivery semantics of a RabbitMQ queue: delivered messages stay unacked until they are
+    settled, rejected ones are requeued in front and redelivered. With a journal every message survives a restart until
+    it is acked, the journal is compacted every `compact_every` acks.
+    """
+
+    def __init__(self, name: str, journal: QueueJournal = None, compact_every: int = 10000):
+        self.name = name
+        self._journal = journal
+        self._compact_every = compact_every
+        # (message id, headers, body, redelivered)
+        self._ready: Deque[Tuple[int, dict, bytes, bool]] = deque()
+        self._unacked: Dict[int, EmbeddedMessage] = {}
+        self._next_id = 1
+        self._next_tag = 1
+        self._acked = 0
+        self.changed = asyncio.Event()
+
+        if journal is not None:
+            restored = journal.load()
+            # published before the restart, possibly delivered already
+            self._ready.extend((message_id, headers, body, True) for message_id, (headers, body) in restored.items())
+            self._next_id = max(restored, default=0) + 1
+            journal.compact(self._pending())
+            if restored:
+                log.info(f"Restored {len(restored)} messages to queue {name}")
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    @property
+    def unacked(self) -> int:
+        return len(self._unacked)
+
+    def _pending(self):
+        for message in self._unacked.values():
+            yield message.message_id, message.headers, message.body
+        for message_id, headers, body, redelivered in self._ready:
+            yield message_id, headers, body
+
+    def put(self, headers: dict, body: bytes) -> None:
+        message_id = self._next_id
+        self._next_id += 1
+        if self._journal is not None:
+            self._journal.publish(message_id, headers, body)
+        self._ready.append((message_id, headers, body, False))
+        self.changed.set()
+
+    def get(self) -> EmbeddedMessage:
+        message_id, headers, body, redelivered = self._ready.popleft()
+        message = EmbeddedMessage(self, message_id, self._next_tag, headers, body, redelivered=redelivered)
+        self._next_tag += 1
+        self._unacked[message.delivery_tag] = message
+        return message
+
+    def settle(self, message: EmbeddedMessage, requeue: bool) -> None:
+        self._unacked.pop(message.delivery_tag, None)
+        if requeue:
+            self._ready.appendleft((message.message_id, message.headers, message.body, True))
+        elif self._journal is not None:
+            self._journal.ack(message.message_id)
+            self._acked += 1
+            if self._acked >= self._compact_every:
+                self._journal.compact(self._pending())
+                self._acked = 0
+        self.changed.set()
+
+    def close(self) -> None:
+        if self._journal is not None:
+            self._journal.close()
+            # a message settled after the close stays pending in the journal, it is redelivered after a restart
+            self._journal = None
+
+
+class EmbeddedWorker(BaseWorker):
+    """
+    In process transport, publishers and consumers share asyncio queues on one event loop instead of going through a
+    broker. Queues are journaled to `journal_dir` if given. There are no exchanges, every publish is routed like on
+    the default exchange, to the queue named by its routing key (created on first use).
+    """
+
+    def __init__(self,
+                 prefetch_count: int = 1,
+                 journal_dir: str = None,
+                 compact_every: int = 10000,
+                 loop: AbstractEventLoop = None):
+        self._prefetch_count = prefetch_count
+        self._journal_dir = journal_dir
+        self._compact_every = compact_every
+        self._queues: Dict[str, EmbeddedQueue] = {}
+        self._consumers: List[Task] = []
+        self._deliveries: Set[Task] = set()
+        self._started = False
+        super().__init__(loop=loop)
+
+    async def start(self) -> None:
+        log.info(f"Starting embedded worker, journal: {self._journal_dir or 'disabled'}")
+        self._started = True
+        await super().start()
+
+    async def stop(self):
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        # deliveries still running would settle into closed journals
+        deliveries = list(self._deliveries)
+        for delivery in deliveries:
+            delivery.cancel()
+        await asyncio.gather(*deliveries, return_exceptions=True)
+        # unacked messages are redelivered from the journal on the next start
+        for queue in self._queues.values():
+            queue.close()
+        await super().stop()
+
+    @property
+    def prefetch_count(self) -> int:
+        return self._prefetch_count
+
+    async def set_prefetch(self, prefetch_count: int) -> None:
+        if prefetch_count == self._prefetch_count:
+            return
+        log.info(f"Changing prefetch count from {self._prefetch_count} to {prefetch_count}")
+        self._prefetch_count = prefetch_count
+        for queue in self._queues.values():
+            queue.changed.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._started and not self._stopped
+
+    def _queue(self, name: str) -> EmbeddedQueue:
+        queue = self._queues.get(name)
+        if queue is None:
+            journal = QueueJournal(os.path.join(self._journal_dir, f"{name}.journal")) if self._journal_dir else None
+            queue = self._queues[name] = EmbeddedQueue(name, journal=journal, compact_every=self._compact_every)
+        return queue
+
+    async def register_queue(self, queue_info: QueueInfo, callback: Callable[[EmbeddedMessage], Coroutine]):
+        queue = self._queue(queue_info.name)
+        self._consumers.append(self._loop.create_task(self._consume(queue, queue_info, callback)))
+
+    async def _consume(self, queue: EmbeddedQueue, queue_info: QueueInfo, callback: Callable) -> None:
+        while not self._stopped:
+            # a prefetch count of 0 is unlimited, as in AMQP
+            limit = self._prefetch_count if queue_info.prefetch_count is None else queue_info.prefetch_count
+            if not len(queue) or (limit and queue.unacked >= limit):
+                queue.changed.clear()
+                await queue.changed.wait()
+                continue
+            delivery = self._loop.create_task(callback(queue.get()))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._delivered)
+
+    def _delivered(self, delivery: Task) -> None:
+        self._deliveries.discard(delivery)
+        if not delivery.cancelled() and delivery.exception() is not None:
+            log.error("Unhandled error in queue callback", exc_info=delivery.exception())
+
+    async def publish(self, routing_key: str, body: bytes, headers: dict = None, exchange: str = "") -> None:
+        self._queue(routing_key).put(headers or {}, body)
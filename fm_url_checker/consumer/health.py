@@ -0,0 +1,89 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Union, Any
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class HealthState:
+    started_at: float = field(default_factory=time.monotonic)
+    broker_ready_at: float = None
+    first_job_at: float = None
+    ready_check: Callable[[], bool] = None
+
+    def broker_ready(self) -> None:
+        if self.broker_ready_at is None:
+            self.broker_ready_at = time.monotonic()
+            log.info(f"Cold start, broker ready after {self.broker_ready_at - self.started_at:.3f}s")
+
+    def job_processed(self) -> None:
+        if self.first_job_at is None:
+            self.first_job_at = time.monotonic()
+            log.info(f"Cold start, first job processed after {self.first_job_at - self.started_at:.3f}s")
+
+    @property
+    def ready(self) -> bool:
+        if self.broker_ready_at is None:
+            return False
+        return self.ready_check() if self.ready_check else True
+
+    def info(self) -> Dict[str, Union[bool, float]]:
+        def since_start(timestamp: float) -> float:
+            return None if timestamp is None else round(timestamp - self.started_at, 3)
+
+        return {
+            "ready": self.ready,
+            "uptime": round(time.monotonic() - self.started_at, 3),
+            "broker_ready_after": since_start(self.broker_ready_at),
+            "first_job_after": since_start(self.first_job_at),
+        }
+
+
+state = HealthState()
+
+_metrics: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    """ Adds a section to the /metrics endpoint, the provider is called on every request """
+
+    _metrics[name] = provider
+
+
+def metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: provider() for name, provider in _metrics.items()}
+
+
+async def _live(request: web.Request) -> web.Response:
+    return web.json_response({"live": True})
+
+
+async def _ready(request: web.Request) -> web.Response:
+    info = state.info()
+    return web.json_response(info, status=200 if info["ready"] else 503)
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.json_response(metrics())
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/health/live", _live)
+    app.router.add_get("/health/ready", _ready)
+    app.router.add_get("/metrics", _metrics_handler)
+    return app
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """ Starts the liveness/readiness http endpoints, returns the runner so it can be cleaned up """
+
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    log.info(f"Health endpoints listening on {host}:{port}")
+    return runner
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List
+
+from fm_url_checker.consumer import settings
+
+log = logging.getLogger(__name__)
+
+
+class MemoryBudgetExhausted(Exception):
+    pass
+
+
+class MemoryBudget:
+    """
+    Worker wide byte budget for response buffers.
+
+    Fetches reserve the space they read into before reading and wait while the budget is exhausted, a reservation
+    that can't be satisfied within the timeout raises MemoryBudgetExhausted so the job can be requeued instead of
+    waiting forever. Pressure callbacks fire when the reserved bytes cross the pressure threshold.
+    """
+
+    def __init__(self, limit: int, pressure_ratio: float = 0.8, timeout: float = 30):
+        self.limit = limit
+        self.reserved = 0
+        self.peak = 0
+        self.waiting = 0
+        self.exhausted = 0
+        self._pressure_threshold = limit * pressure_ratio
+        self._timeout = timeout
+        self._pressure = False
+        self._pressure_callbacks: List[Callable[[bool], None]] = []
+        self._condition: asyncio.Condition = None
+
+    @property
+    def under_pressure(self) -> bool:
+        return self._pressure
+
+    def add_pressure_callback(self, callback: Callable[[bool], None]) -> None:
+        self._pressure_callbacks.append(callback)
+
+    def _update_pressure(self) -> None:
+        pressure = self.reserved >= self._pressure_threshold
+        if pressure != self._pressure:
+            self._pressure = pressure
+            log.warning(f"Memory budget pressure {'on' if pressure else 'off'}",
+                        extra={"reserved": self.reserved, "limit": self.limit})
+            for callback in self._pressure_callbacks:
+                callback(pressure)
+
+    async def reserve(self, nbytes: int) -> None:
+        if nbytes > self.limit:
+            raise MemoryBudgetExhausted(f"Reservation of {nbytes} bytes exceeds the budget of {self.limit} bytes")
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        async with self._condition:
+            if self.reserved + nbytes > self.limit:
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self._condition.wait_for(lambda: self.reserved + nbytes <= self.limit),
+                                           timeout=self._timeout)
+                except asyncio.TimeoutError:
+                    self.exhausted += 1
+                    raise MemoryBudgetExhausted(f"Timed out waiting for {nbytes} bytes of the memory budget")
+                finally:
+                    self.waiting -= 1
+            self.reserved += nbytes
+            self.peak = max(self.peak, self.reserved)
+        self._update_pressure()
+
+    def release(self, nbytes: int) -> None:
+        self.reserved -= nbytes
+        self._update_pressure()
+        if self._condition is not None and self.waiting:
+            asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+
+    def info(self) -> Dict[str, int]:
+        return {
+            "limit": self.limit,
+            "reserved": self.reserved,
+            "peak": self.peak,
+            "waiting": self.waiting,
+            "exhausted": self.exhausted,
+        }
+
+
+def fetch_reservation() -> int:
+    """ Bytes a fetch holds while reading: a chunk and its decoded text, at up to 4 bytes per character """
+
+    return settings.READ_CHUNK_SIZE * 5
+
+
+def check_settings() -> None:
+    """ A single fetch must fit the budget, otherwise it fails no matter how long it waits """
+
+    if settings.MEMORY_BUDGET < fetch_reservation():
+        raise ValueError(f"MEMORY_BUDGET of {settings.MEMORY_BUDGET} bytes is below the {fetch_reservation()} bytes "
+                         f"a fetch reserves (5 x READ_CHUNK_SIZE)")
+
+
+budget = MemoryBudget(limit=settings.MEMORY_BUDGET,
+                      pressure_ratio=settings.MEMORY_PRESSURE_RATIO,
+                      timeout=settings.MEMORY_RESERVE_TIMEOUT)
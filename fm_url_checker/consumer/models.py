@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List
 
 
 @dataclass
@@ -7,11 +8,38 @@ class Job:
     url: str
 
 
+@dataclass
+class Redirect:
+    status: int
+    url: str
+    location: str
+
+
+@dataclass
+class PhaseTimings:
+    """ HTTP phase durations in seconds, None for phases that didn't happen (cached dns, reused connection) """
+
+    queued: float = None
+    dns: float = None
+    connect: float = None
+    ttfb: float = None
+    transfer: float = None
+    total: float = None
+    connection_reused: bool = False
+    redirects: int = 0
+
+
 @dataclass
 class JobResult:
     job: Job
     status: int = None
     size: int = None
+    truncated: bool = False
+    host_unavailable: bool = False
+    timings: PhaseTimings = None
+    redirects: List[Redirect] = field(default_factory=list)
+    final_url: str = None
+    redirect_hops_saved: int = 0
 
 
 class ValidationError(Exception):
@@ -0,0 +1,69 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+from fm_url_checker.consumer import settings
+
+log = logging.getLogger(__name__)
+
+PERMANENT_REDIRECTS = (301, 308)
+
+
+class RedirectCache:
+    """
+    Bounded LRU of permanent (301/308) redirects with a TTL. Checks of a cached URL go straight to the end of its
+    known redirect chain instead of walking it again.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 86400, clock: Callable[[], float] = time.monotonic):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._entries: Dict[str, Tuple[str, float]] = OrderedDict()
+        self.hits = 0
+        self.hops_saved = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, url: str, location: str) -> None:
+        if url == location:
+            return
+        self._entries.pop(url, None)
+        self._entries[url] = (location, self._clock() + self._ttl)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def _get(self, url: str) -> str:
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        location, expires = entry
+        if expires <= self._clock():
+            del self._entries[url]
+            return None
+        self._entries.move_to_end(url)
+        return location
+
+    def resolve(self, url: str, max_hops: int) -> Tuple[str, int]:
+        """ Follows cached redirects from url, returns the final known location and the number of hops skipped """
+
+        hops = 0
+        seen = {url}
+        location = self._get(url)
+        while location is not None and hops < max_hops and location not in seen:
+            url = location
+            seen.add(url)
+            hops += 1
+            location = self._get(url)
+        if hops:
+            self.hits += 1
+            self.hops_saved += hops
+        return url, hops
+
+    def info(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "hops_saved": self.hops_saved}
+
+
+cache = RedirectCache(max_size=settings.REDIRECT_CACHE_SIZE, ttl=settings.REDIRECT_CACHE_TTL)
@@ -1,14 +1,17 @@
 import asyncio
 import logging
 import signal
-from asyncio import AbstractEventLoop
+import sys
+from asyncio import AbstractEventLoop, Task
 
 import functools
 import uvloop
 
-from fm_url_checker.consumer import settings, url_check
+from fm_url_checker.consumer import settings, url_check, health, memory, concurrency, circuit_breaker, tracing, \
+    redirects
 from fm_url_checker.consumer.amqp.models import ConnectionArgs, QueueInfo
-from fm_url_checker.consumer.amqp.worker import Worker
+from fm_url_checker.consumer.amqp.probe import BrokerUnavailable
+from fm_url_checker.consumer.amqp.worker import Worker, BaseWorker
 
 log = logging.getLogger(__name__)
 
@@ -20,6 +23,55 @@ def shutdown(loop: AbstractEventLoop, sig: int, *async_cleanups):
         task.add_done_callback(lambda *args, **kwargs: loop.stop())
 
 
+def stop_on_failure(loop: AbstractEventLoop, task: Task) -> None:
+    """ Stops the loop once the startup task failed, run() then exits non-zero so the process gets restarted """
+
+    if task.cancelled() or task.exception() is None:
+        return
+    error = task.exception()
+    if isinstance(error, BrokerUnavailable):
+        log.error(f"Broker unavailable, exiting: {error}")
+    else:
+        log.error(f"Startup failed, exiting: {error.__class__.__name__}: {error}", exc_info=error)
+    loop.stop()
+
+
+def exit_code(task: Task) -> int:
+    return 1 if task.done() and not task.cancelled() and task.exception() is not None else 0
+
+
+def update_prefetch(worker: BaseWorker) -> None:
+    """ Follows the concurrency limit, unless the memory budget is under pressure """
+
+    prefetch = concurrency.controller.limit
+    if memory.budget.under_pressure:
+        prefetch = min(prefetch, settings.MEMORY_PRESSURE_PREFETCH_COUNT)
+    asyncio.ensure_future(worker.set_prefetch(prefetch))
+
+
+async def startup(worker: BaseWorker, health_server: bool = True) -> None:
+    """ Starts consuming jobs on the worker, without the health server when it runs embedded in another service """
+
+    memory.check_settings()
+    health.state.ready_check = lambda: worker.ready
+    health.register_metrics("memory", memory.budget.info)
+    health.register_metrics("concurrency", concurrency.controller.info)
+    health.register_metrics("circuit_breaker", circuit_breaker.breaker.info)
+    health.register_metrics("redirects", redirects.cache.info)
+    if tracing.tracer:
+        health.register_metrics("tracing", tracing.tracer.info)
+    memory.budget.add_pressure_callback(lambda pressure: update_prefetch(worker))
+    concurrency.controller.add_limit_callback(lambda limit: update_prefetch(worker))
+    if health_server:
+        await health.start_server(host=settings.HEALTH_HOST, port=settings.HEALTH_PORT)
+
+    await concurrency.controller.start()
+    await worker.start()
+    await worker.register_queue(QueueInfo(name="jobs", channels=settings.RABBITMQ_JOB_CHANNELS),
+                                url_check.received_job)
+    health.state.broker_ready()
+
+
 def run():
     asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     loop = asyncio.get_event_loop()
@@ -29,17 +81,22 @@ def run():
                                                    login=settings.RABBITMQ_USER,
                                                    password=settings.RABBITMQ_PASS,
                                                    virtualhost=settings.RABBITMQ_VHOST),
-                    prefetch_count=1,
+                    prefetch_count=concurrency.controller.limit,
+                    startup_timeout=settings.RABBITMQ_STARTUP_TIMEOUT,
+                    probe_max_delay=settings.RABBITMQ_PROBE_MAX_DELAY,
+                    reconnect_delay=settings.RABBITMQ_RECONNECT_DELAY,
+                    connections=settings.RABBITMQ_CONNECTIONS,
                     loop=loop)
 
     for sig in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(sig,
-                                functools.partial(shutdown, loop, sig, worker.stop))
+                                functools.partial(shutdown, loop, sig, worker.stop, concurrency.controller.stop))
 
-    loop.create_task(worker.start())
-    loop.create_task(worker.register_queue(QueueInfo(name="jobs"), url_check.received_job))
+    startup_task = loop.create_task(startup(worker))
+    startup_task.add_done_callback(functools.partial(stop_on_failure, loop))
 
     loop.run_forever()
+    sys.exit(exit_code(startup_task))
 
 
 if __name__ == '__main__':
@@ -18,6 +18,50 @@ RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "rabbitmq")
 RABBITMQ_VHOST = os.getenv("RABBITMQ_VHOST", "/")
 RABBITMQ_JOB_EXCHANGE = os.getenv("RABBITMQ_JOB_EXCHANGE", "")
 RABBITMQ_JOB_ROUTING_KEY = os.getenv("RABBITMQ_JOB_ROUTING_KEY", "jobs")
+RABBITMQ_PREFETCH_COUNT = int(os.getenv("RABBITMQ_PREFETCH_COUNT", "1"))
+RABBITMQ_STARTUP_TIMEOUT = float(os.getenv("RABBITMQ_STARTUP_TIMEOUT", "60"))
+RABBITMQ_PROBE_MAX_DELAY = float(os.getenv("RABBITMQ_PROBE_MAX_DELAY", "5"))
+RABBITMQ_RECONNECT_DELAY = float(os.getenv("RABBITMQ_RECONNECT_DELAY", "1"))
+RABBITMQ_CONNECTIONS = int(os.getenv("RABBITMQ_CONNECTIONS", "1"))
+RABBITMQ_JOB_CHANNELS = int(os.getenv("RABBITMQ_JOB_CHANNELS", "1"))
+
+HEALTH_HOST = os.getenv("HEALTH_HOST", "0.0.0.0")
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "8081"))
+
+# Worker wide budget for response buffers, see memory.MemoryBudget
+MEMORY_BUDGET = int(os.getenv("MEMORY_BUDGET", str(256 * 1024 * 1024)))
+MEMORY_PRESSURE_RATIO = float(os.getenv("MEMORY_PRESSURE_RATIO", "0.8"))
+MEMORY_RESERVE_TIMEOUT = float(os.getenv("MEMORY_RESERVE_TIMEOUT", "30"))
+# Prefetch count used while the memory budget is under pressure
+MEMORY_PRESSURE_PREFETCH_COUNT = int(os.getenv("MEMORY_PRESSURE_PREFETCH_COUNT", "1"))
+
+READ_CHUNK_SIZE = int(os.getenv("READ_CHUNK_SIZE", str(64 * 1024)))
+MAX_RESPONSE_SIZE = int(os.getenv("MAX_RESPONSE_SIZE", str(10 * 1024 * 1024)))
+
+# Adaptive concurrency (and prefetch) limits, see concurrency.ConcurrencyController. The defaults keep a fixed limit of 1
+CONCURRENCY_FLOOR = int(os.getenv("CONCURRENCY_FLOOR", "1"))
+CONCURRENCY_CEILING = int(os.getenv("CONCURRENCY_CEILING", "1"))
+CONCURRENCY_ADJUST_INTERVAL = float(os.getenv("CONCURRENCY_ADJUST_INTERVAL", "1"))
+CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv("CONCURRENCY_LATENCY_TOLERANCE", "1.5"))
+CONCURRENCY_MAX_ERROR_RATE = float(os.getenv("CONCURRENCY_MAX_ERROR_RATE", "0.2"))
+CONCURRENCY_MAX_LOOP_LAG = float(os.getenv("CONCURRENCY_MAX_LOOP_LAG", "0.1"))
+# Adjust intervals between baseline latency probes, 0 disables them
+CONCURRENCY_PROBE_EVERY = int(os.getenv("CONCURRENCY_PROBE_EVERY", "60"))
+
+# Per host circuit breaker for connection level failures, see circuit_breaker.CircuitBreaker
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+CIRCUIT_MAX_HOSTS = int(os.getenv("CIRCUIT_MAX_HOSTS", "10000"))
+
+# Opt-in HTTP phase tracing, see tracing.Tracer. Sampled spans are appended to the export path as OTLP/JSON lines
+TRACING_ENABLED = (os.getenv("TRACING_ENABLED", "false").lower() in ("y", "yes", "t", "true"))
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "0.01"))
+TRACING_EXPORT_PATH = os.getenv("TRACING_EXPORT_PATH", "spans.jsonl")
+
+MAX_REDIRECTS = int(os.getenv("MAX_REDIRECTS", "10"))
+# Permanent (301/308) redirects cache, see redirects.RedirectCache
+REDIRECT_CACHE_SIZE = int(os.getenv("REDIRECT_CACHE_SIZE", "100000"))
+REDIRECT_CACHE_TTL = float(os.getenv("REDIRECT_CACHE_TTL", "86400"))
 
 if DEBUG:
     logging.getLogger("").setLevel("DEBUG")
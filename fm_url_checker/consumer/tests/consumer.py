@@ -1,23 +1,52 @@
+import asyncio
 import json
+import random
 from contextlib import asynccontextmanager
 from uuid import uuid4
 
 import pytest
 import re
 from aio_pika import IncomingMessage
-from aiohttp import ClientConnectorError, ClientOSError
+from aio_pika.exceptions import MessageProcessError
+from aiohttp import ClientConnectorError, ClientOSError, web
 from flexmock import flexmock
-
-from fm_url_checker.consumer import url_check
+from yarl import URL
+
+from fm_url_checker.consumer import url_check, health, memory, settings, concurrency, circuit_breaker, tracing, \
+    redirects
+from fm_url_checker.consumer import run as consumer_run
+from fm_url_checker.consumer.amqp import worker as amqp_worker
+from fm_url_checker.consumer.amqp.models import ConnectionArgs, QueueInfo
+from fm_url_checker.consumer.embedded.worker import EmbeddedWorker
+from fm_url_checker.consumer.amqp.probe import wait_for_broker, BrokerUnavailable
 from fm_url_checker.consumer.models import Job, ValidationError, JobResult
 
 UUID_REX = re.compile(r"[0-9a-f]{32}")
 
 
+class FakeStreamReader:
+    def __init__(self, body: bytes):
+        self.body = body
+        self.position = 0
+
+    async def read(self, n: int = -1) -> bytes:
+        chunk = self.body[self.position:self.position + n]
+        self.position += len(chunk)
+        return chunk
+
+    def at_eof(self) -> bool:
+        return self.position >= len(self.body)
+
+
 class FakeAiohttpResponse:
     def __init__(self, status: int = 200, body: str = "body"):
         self.status = status
         self.body = body
+        self.charset = "utf8"
+        self.content = FakeStreamReader(body.encode("utf8"))
+        self.content_length = len(self.content.body)
+        self.history = ()
+        self.url = None
 
     async def text(self):
         return self.body
@@ -37,6 +66,7 @@ class FakeAiohttpSession:
         if self.exception:
             raise self.exception
         self.url = url
+        self.response.url = url
         self.extra_args = args
         self.extra_kwargs = kwargs
         yield self.response
@@ -222,3 +252,726 @@ class TestReceivedJob:
         assert message.reject_called, "reject called"
         assert not message.reject_requeue, "reject called with requeue=True"
 
+
+@pytest.mark.consumer
+@pytest.mark.asyncio
+class TestBrokerProbe:
+    async def test_broker_available_later(self):
+        loop = asyncio.get_event_loop()
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+
+        async def delayed_start():
+            await asyncio.sleep(0.3)
+            return await asyncio.start_server(lambda reader, writer: writer.close(), host="127.0.0.1", port=port)
+
+        server_task = loop.create_task(delayed_start())
+        waited = await wait_for_broker(ConnectionArgs(host="127.0.0.1", port=port),
+                                       initial_delay=0.05, max_delay=0.2, timeout=5)
+        server = await server_task
+        server.close()
+
+        assert 0.3 <= waited < 2, "probe did not pick up the broker promptly"
+
+    async def test_broker_unavailable(self):
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+
+        with pytest.raises(BrokerUnavailable):
+            await wait_for_broker(ConnectionArgs(host="127.0.0.1", port=port),
+                                  initial_delay=0.05, max_delay=0.1, timeout=0.3)
+
+
+class FakeExchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((routing_key, message))
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_closed = False
+        self.default_exchange = FakeExchange()
+        self.qos = None
+        self.consumers = []
+        # max broker round trip in seconds
+        self.delay = 0
+
+    async def round_trip(self):
+        await asyncio.sleep(random.uniform(0, self.delay))
+
+    async def set_qos(self, prefetch_size=0, prefetch_count=0):
+        await self.round_trip()
+        self.qos = prefetch_count
+
+    async def declare_queue(self, name, durable):
+        channel = self
+
+        class FakeQueue:
+            async def consume(self, callback):
+                await channel.round_trip()
+                channel.consumers.append(name)
+                return f"tag-{name}"
+
+            async def cancel(self, consumer_tag):
+                await channel.round_trip()
+                channel.consumers.remove(consumer_tag[len("tag-"):])
+
+        return FakeQueue()
+
+
+class FakeRobustConnection:
+    def __init__(self, **kwargs):
+        self.is_closed = False
+        self.channels = []
+        self.callbacks = {}
+
+    def add_connection_lost_callback(self, callback):
+        self.callbacks["lost"] = callback
+
+    def add_close_callback(self, callback):
+        self.callbacks["close"] = callback
+
+    def add_reconnect_callback(self, callback):
+        self.callbacks["reconnect"] = callback
+
+    async def channel(self):
+        self.channels.append(FakeChannel(self))
+        return self.channels[-1]
+
+    async def close(self):
+        self.is_closed = True
+
+
+@pytest.mark.consumer
+@pytest.mark.asyncio
+class TestWorker:
+    async def connected_worker(self, **kwargs) -> amqp_worker.Worker:
+        self.opened = []
+
+        async def connect_robust(**connection_kwargs):
+            self.opened.append(FakeRobustConnection(**connection_kwargs))
+            return self.opened[-1]
+
+        async def broker_available(*args, **kwargs):
+            return 0
+
+        flexmock(amqp_worker, wait_for_broker=broker_available)
+        flexmock(amqp_worker.aio_pika, connect_robust=connect_robust)
+        worker = amqp_worker.Worker(ConnectionArgs(), **kwargs)
+        await worker.start()
+        return worker
+
+    async def test_register_after_start(self):
+        worker = await self.connected_worker()
+
+        async def callback(message):
+            pass
+
+        await worker.register_queue(QueueInfo(name="jobs"), callback)
+
+        assert len(self.opened) == 1, "connected twice"
+        assert worker._queue_channels["jobs"][0].consumers == ["jobs"], "queue not consumed after start"
+        assert worker.ready
+
+    async def test_startup_broker_unavailable(self):
+        async def broker_unavailable(*args, **kwargs):
+            raise BrokerUnavailable("Broker unreachable")
+
+        async def noop(*args, **kwargs):
+            pass
+
+        flexmock(amqp_worker, wait_for_broker=broker_unavailable)
+        flexmock(health, start_server=noop)
+        flexmock(concurrency.controller, start=noop)
+        worker = amqp_worker.Worker(ConnectionArgs())
+        loop = flexmock()
+        loop.should_receive("stop").once()
+
+        task = asyncio.ensure_future(consumer_run.startup(worker))
+        await asyncio.wait([task])
+        consumer_run.stop_on_failure(loop, task)
+
+        assert consumer_run.exit_code(task) == 1, "startup failure not reported"
+        assert worker._connection_task is None, "failed connection attempt kept"
+
+    async def test_channels_spread_over_connections(self):
+        worker = await self.connected_worker(connections=2, prefetch_count=8)
+
+        async def callback(message):
+            pass
+
+        await worker.register_queue(QueueInfo(name="jobs", channels=4), callback)
+        await worker.register_queue(QueueInfo(name="slow", prefetch_count=1), callback)
+
+        connections = worker._connections
+        assert len(connections) == 2
+        assert all(set(connection.callbacks) == {"lost", "close", "reconnect"} for connection in connections), \
+            "reconnect handling not registered on every connection"
+
+        jobs = worker._queue_channels["jobs"]
+        assert [channel.consumers for channel in jobs] == [["jobs"]] * 4, "jobs not consumed on its own channels"
+        assert [channel.connection for channel in jobs].count(connections[0]) == 2, "channels not spread"
+        assert [channel.qos for channel in jobs] == [2] * 4, "prefetch not split over the queue channels"
+        assert [channel.qos for channel in worker._queue_channels["slow"]] == [1]
+
+        await worker.set_prefetch(20)
+        assert [channel.qos for channel in jobs] == [5] * 4, "runtime prefetch not applied"
+        assert worker._queue_channels["slow"][0].qos == 1, "fixed queue prefetch overridden"
+
+        await worker.set_prefetch(6)
+        assert [channel.qos for channel in jobs] == [2, 2, 1, 1], "prefetch not split exactly"
+
+        await worker.set_prefetch(2)
+        assert [channel.consumers for channel in jobs] == [["jobs"]] * 2 + [[]] * 2, \
+            "channels without a share still consuming"
+        assert [channel.qos for channel in jobs[:2]] == [1, 1], "prefetch over the total"
+
+        await worker.set_prefetch(8)
+        assert [channel.consumers for channel in jobs] == [["jobs"]] * 4, "channels not consuming again"
+        assert [channel.qos for channel in jobs] == [2] * 4
+
+        for channel in jobs:
+            channel.delay = 0.002
+        for _ in range(20):
+            # memory pressure and the concurrency limit update the prefetch at the same time
+            await asyncio.gather(worker.set_prefetch(1), worker.set_prefetch(8))
+            assert worker.prefetch_count == 8
+            assert [channel.qos for channel in jobs] == [2] * 4, "concurrent updates left a wrong QoS"
+            assert [channel.consumers for channel in jobs] == [["jobs"]] * 4, "concurrent updates lost consumers"
+
+        assert worker.ready
+        connections[1].is_closed = True
+        assert not worker.ready, "lost connection not reflected in readiness"
+        connections[1].is_closed = False
+
+        await worker.stop()
+        assert all(connection.is_closed for connection in connections), "connections left open"
+
+
+@pytest.mark.consumer
+@pytest.mark.asyncio
+class TestEmbeddedWorker:
+    async def test_received_job(self):
+        worker = EmbeddedWorker()
+        await worker.start()
+        flexmock(url_check).should_receive("ClientSession").and_return(FakeAiohttpSession(body="body"))
+        completed = asyncio.Event()
+        flexmock(health.state).should_receive("job_processed").replace_with(completed.set)
+
+        job_id = uuid4().hex
+        await worker.publish("jobs", json.dumps({"url": "http://www.google.com"}).encode("utf8"), {"job_id": job_id})
+        await worker.register_queue(QueueInfo(name="jobs"), url_check.received_job)
+        await asyncio.wait_for(completed.wait(), 1)
+        await asyncio.sleep(0)
+
+        queue = worker._queues["jobs"]
+        assert len(queue) == 0 and queue.unacked == 0, "job not acked"
+        await worker.stop()
+
+    async def test_prefetch_and_requeue(self):
+        worker = EmbeddedWorker(prefetch_count=2)
+        await worker.start()
+        received = []
+
+        async def callback(message):
+            received.append(message)
+
+        await worker.register_queue(QueueInfo(name="queue"), callback)
+        for i in range(5):
+            await worker.publish("queue", str(i).encode("utf8"))
+        await asyncio.sleep(0.01)
+        assert [message.body for message in received] == [b"0", b"1"], "prefetch count not respected"
+
+        received[0].reject(requeue=True)
+        received[1].ack()
+        await asyncio.sleep(0.01)
+        assert [(message.body, message.redelivered) for message in received[2:]] == [(b"0", True), (b"2", False)], \
+            "rejected message not requeued in front"
+
+        await worker.set_prefetch(10)
+        await asyncio.sleep(0.01)
+        assert len(received) == 6, "prefetch change not applied"
+        with pytest.raises(MessageProcessError):
+            received[1].ack()
+        await worker.stop()
+
+    async def test_journal(self, tmp_path):
+        worker = EmbeddedWorker(prefetch_count=0, journal_dir=str(tmp_path), compact_every=2)
+        await worker.start()
+        received = []
+
+        async def callback(message):
+            received.append(message)
+
+        await worker.register_queue(QueueInfo(name="queue"), callback)
+        for i in range(4):
+            await worker.publish("queue", str(i).encode("utf8"), {"n": i})
+        await asyncio.sleep(0.01)
+        for message in received[:3]:
+            message.ack()
+        await worker.stop()
+
+        restarted = EmbeddedWorker(prefetch_count=0, journal_dir=str(tmp_path))
+        await restarted.start()
+        received.clear()
+        await restarted.register_queue(QueueInfo(name="queue"), callback)
+        await restarted.publish("queue", b"4")
+        await asyncio.sleep(0.01)
+        await restarted.stop()
+
+        assert [(message.body, message.headers, message.redelivered) for message in received] == [
+            (b"3", {"n": 3}, True), (b"4", {}, False)], "unacked messages not restored"
+
+    async def test_stop_with_deliveries_in_flight(self, tmp_path):
+        worker = EmbeddedWorker(prefetch_count=0, journal_dir=str(tmp_path))
+        await worker.start()
+        received = []
+        cancelled = []
+
+        async def callback(message):
+            received.append(message)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(message)
+                raise
+            message.ack()
+
+        await worker.register_queue(QueueInfo(name="queue"), callback)
+        await worker.publish("queue", b"0")
+        await asyncio.sleep(0.01)
+        await worker.stop()
+        assert cancelled == received, "delivery left running after stop"
+
+        received[0].ack()
+        assert worker._queues["queue"]._journal is None, "journal reopened after stop"
+        assert "A\t" not in (tmp_path / "queue.journal").read_text(), "journal written after stop"
+
+
+@pytest.mark.consumer
+class TestHealth:
+    def test_readiness(self):
+        state = health.HealthState()
+        assert not state.ready, "ready before the broker connection"
+
+        state.broker_ready()
+        assert state.ready, "not ready after the broker connection"
+
+        state.ready_check = lambda: False
+        assert not state.ready, "ready check ignored"
+
+    def test_cold_start(self):
+        state = health.HealthState()
+        assert state.info()["first_job_after"] is None, "first job reported before any job"
+
+        state.job_processed()
+        first_job_after = state.info()["first_job_after"]
+        state.job_processed()
+        assert first_job_after is not None, "first job not reported"
+        assert state.info()["first_job_after"] == first_job_after, "first job time overwritten"
+
+
+@asynccontextmanager
+async def local_server(handler):
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host="127.0.0.1", port=0)
+    await site.start()
+    try:
+        yield f"http://127.0.0.1:{runner.addresses[0][1]}"
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.consumer
+@pytest.mark.asyncio
+class TestMemoryBudget:
+    async def test_reserve_and_wait(self):
+        budget = memory.MemoryBudget(limit=100, pressure_ratio=0.5, timeout=1)
+        pressure = []
+        budget.add_pressure_callback(pressure.append)
+
+        await budget.reserve(60)
+        assert budget.under_pressure and pressure == [True], "pressure not reported"
+
+        waiter = asyncio.ensure_future(budget.reserve(60))
+        await asyncio.sleep(0.05)
+        assert not waiter.done() and budget.waiting == 1, "reservation over the budget didn't wait"
+
+        budget.release(60)
+        await asyncio.wait_for(waiter, timeout=1)
+        assert budget.reserved == 60 and budget.peak == 60, "wrong reserved bytes"
+
+        budget.release(60)
+        assert pressure == [True, False, True, False], "pressure changes not reported"
+
+    async def test_exhausted(self):
+        budget = memory.MemoryBudget(limit=100, timeout=0.05)
+        await budget.reserve(100)
+        with pytest.raises(memory.MemoryBudgetExhausted):
+            await budget.reserve(1)
+        with pytest.raises(memory.MemoryBudgetExhausted):
+            await budget.reserve(101)
+        assert budget.exhausted == 1 and budget.waiting == 0, "wrong exhausted stats"
+
+    async def test_large_bodies(self):
+        body = b"x" * (1024 * 1024)
+
+        async def handler(request):
+            if request.path == "/chunked":
+                response = web.StreamResponse()
+                await response.prepare(request)
+                for i in range(0, len(body), 64 * 1024):
+                    await response.write(body[i:i + 64 * 1024])
+                    await asyncio.sleep(0)
+                return response
+            return web.Response(body=body)
+
+        budget = memory.MemoryBudget(limit=3 * 1024 * 1024, timeout=10)
+        flexmock(memory, budget=budget)
+        flexmock(concurrency, controller=concurrency.ConcurrencyController(floor=10, ceiling=10))
+        flexmock(settings, READ_CHUNK_SIZE=64 * 1024, MAX_RESPONSE_SIZE=2 * 1024 * 1024)
+
+        async with local_server(handler) as url:
+            results = await asyncio.gather(*[url_check._process_job(Job(id=uuid4().hex, url=f"{url}/{i}"))
+                                             for i in range(10)])
+            results.append(await url_check._process_job(Job(id=uuid4().hex, url=f"{url}/chunked")))
+
+        assert all(result.status == 200 and result.size == len(body) for result in results), "bodies not read"
+        assert not any(result.truncated for result in results), "bodies truncated"
+        assert budget.limit - 1024 * 1024 < budget.peak <= budget.limit, "budget not used or exceeded"
+        assert budget.waiting == 0 and budget.reserved == 0, "reservations leaked"
+
+    async def test_truncated(self):
+        async def handler(request):
+            return web.Response(body=b"x" * 1024)
+
+        flexmock(memory, budget=memory.MemoryBudget(limit=1024 * 1024))
+        flexmock(settings, READ_CHUNK_SIZE=256, MAX_RESPONSE_SIZE=512)
+
+        async with local_server(handler) as url:
+            result = await url_check._process_job(Job(id=uuid4().hex, url=url))
+
+        assert result.truncated and result.size == 512, "body not truncated"
+
+    async def test_truncated_within_chunk(self):
+        async def handler(request):
+            return web.Response(body=b"x" * 1024)
+
+        flexmock(memory, budget=memory.MemoryBudget(limit=1024 * 1024))
+        flexmock(settings, READ_CHUNK_SIZE=256, MAX_RESPONSE_SIZE=600)
+
+        async with local_server(handler) as url:
+            result = await url_check._process_job(Job(id=uuid4().hex, url=url))
+
+        assert result.truncated and result.size == 600, "body read past MAX_RESPONSE_SIZE"
+        assert memory.budget.peak == 5 * 256 and memory.budget.reserved == 0, "wrong reservation"
+
+    async def test_multibyte_across_chunks(self):
+        async def handler(request):
+            return web.Response(body="é".encode("utf8") * 300, charset="utf8")
+
+        flexmock(memory, budget=memory.MemoryBudget(limit=1024 * 1024))
+        flexmock(settings, READ_CHUNK_SIZE=255, MAX_RESPONSE_SIZE=1024)
+
+        async with local_server(handler) as url:
+            result = await url_check._process_job(Job(id=uuid4().hex, url=url))
+
+        assert not result.truncated and result.size == 300, "characters split over chunks miscounted"
+
+    async def test_requeue_when_exhausted(self):
+        (flexmock(url_check)
+         .should_receive("_process_job")
+         .and_raise(memory.MemoryBudgetExhausted("boom")))
+
+        message = FakeIncomingMessage()
+        await url_check.received_job(message)
+        assert message.reject_called and message.reject_requeue, "job not requeued"
+
+
+@pytest.mark.consumer
+class TestMemorySettings:
+    def test_budget_below_fetch(self):
+        flexmock(settings, MEMORY_BUDGET=1024, READ_CHUNK_SIZE=256)
+        with pytest.raises(ValueError):
+            memory.check_settings()
+
+        flexmock(settings, MEMORY_BUDGET=1280)
+        memory.check_settings()
+
+
+@pytest.mark.consumer
+@pytest.mark.asyncio
+class TestConcurrencyController:
+    async def test_slots(self):
+        controller = concurrency.ConcurrencyController(floor=2, ceiling=2)
+        running = []
+
+        async def job():
+            async with controller.slot():
+                running.append(controller.in_flight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[job() for _ in range(6)])
+        assert max(running) == 2, "limit not enforced"
+        assert controller.in_flight == 0, "slots leaked"
+
+    async def test_increase_while_saturated(self):
+        controller = concurrency.ConcurrencyController(floor=1, ceiling=50, initial=4)
+        for _ in range(20):
+            controller._peak_in_flight = controller.limit
+            for _ in range(10):
+                controller.record(0.1)
+            controller.adjust()
+        assert controller.limit > 4 and controller.increases, "limit didn't grow with flat latency"
+
+        limit = controller.limit
+        controller._peak_in_flight = 1
+        controller.record(0.1)
+        controller.adjust()
+        assert controller.limit == limit, "limit grew while not being used"
+
+    async def test_decrease(self):
+        controller = concurrency.ConcurrencyController(floor=2, ceiling=50, initial=40)
+        controller.record(0.1)
+        controller.adjust()
+
+        for _ in range(10):
+            controller.record(1.0)
+            controller.adjust()
+        assert controller.limit < 40, "limit didn't shrink with inflated latency"
+
+        limit = controller.limit
+        controller.record(0.1, error=True)
+        controller.adjust()
+        assert controller.limit < limit, "limit didn't shrink on errors"
+
+        for _ in range(20):
+            controller.record(0.1, error=True)
+            controller.adjust()
+        assert controller.limit == 2 and controller.info()["limit"] == 2, "limit went under the floor"
+
+    async def test_baseline_under_queueing(self):
+        controller = concurrency.ConcurrencyController(floor=1, ceiling=100, initial=40, probe_every=20)
+
+        def interval(latency: float, in_flight: int = None) -> None:
+            controller._peak_in_flight = controller.limit if in_flight is None else in_flight
+            for _ in range(10):
+                controller.record(latency)
+            controller.adjust()
+
+        interval(0.1)
+        for _ in range(10):
+            # every fetch queues at the target, the fastest one included
+            interval(0.3)
+        assert controller.info()["baseline_latency"] == 0.1, "baseline rose while latency was inflated"
+        assert controller.limit < 40, "limit didn't shrink"
+
+        for _ in range(9):
+            interval(0.3)
+        assert controller.limit == 1 and controller.probes == 1, "probe didn't drop to the floor"
+        limit = controller._probe_restore
+
+        interval(0.3, in_flight=10)
+        assert controller.limit == 1, "probe ended before the fetches in flight drained"
+        interval(0.3, in_flight=1)
+        assert controller.limit == int(limit), "limit not restored after the probe"
+        interval(0.3)
+        assert controller.info()["baseline_latency"] == 0.3, "target that got slower not re-measured"
+
+
+@pytest.mark.consumer
+class TestCircuitBreaker:
+    def test_open_and_recover(self):
+        now = [0.0]
+        breaker = circuit_breaker.CircuitBreaker(threshold=3, reset_timeout=10, clock=lambda: now[0])
+
+        for _ in range(2):
+            assert breaker.allow("a.com"), "closed circuit not allowed"
+            breaker.record_failure("a.com")
+        breaker.record_success("a.com")
+        breaker.record_failure("a.com")
+        assert not breaker.is_open("a.com"), "failures not reset by a success"
+
+        breaker.record_failure("a.com")
+        breaker.record_failure("a.com")
+        assert breaker.is_open("a.com") and not breaker.allow("a.com"), "circuit not opened"
+        assert breaker.allow("b.com"), "other hosts affected"
+
+        now[0] = 10
+        assert breaker.allow("a.com"), "half open probe not allowed"
+        assert not breaker.allow("a.com"), "more than one probe allowed"
+        breaker.record_failure("a.com")
+
+        now[0] = 15
+        assert not breaker.allow("a.com"), "failed probe didn't keep the circuit open"
+
+        now[0] = 20
+        assert breaker.allow("a.com"), "second probe not allowed"
+        breaker.record_success("a.com")
+        assert breaker.allow("a.com") and breaker.allow("a.com"), "circuit not closed after a successful probe"
+        assert breaker.info()["short_circuited"] == 3, "wrong short circuit count"
+
+    def test_bounded(self):
+        breaker = circuit_breaker.CircuitBreaker(threshold=1, max_hosts=10)
+        for i in range(100):
+            breaker.record_failure(f"{i}.com")
+        assert breaker.info()["tracked_hosts"] == 10, "host state not bounded"
+        assert breaker.is_open("99.com") and not breaker.is_open("0.com"), "wrong hosts evicted"
+
+
+@pytest.mark.consumer
+@pytest.mark.asyncio
+class TestProcessJobCircuitBreaker:
+    async def test_fail_fast(self):
+        flexmock(circuit_breaker, breaker=circuit_breaker.CircuitBreaker(threshold=2))
+        fake_session = FakeAiohttpSession(exception=ClientConnectorError(flexmock(ssl=None, host="a.com", port=80),
+                                                                         OSError("boom")))
+        (flexmock(url_check)
+         .should_receive("ClientSession")
+         .and_return(fake_session)
+         .times(2))
+
+        for _ in range(2):
+            result = await url_check._process_job(Job(id=uuid4().hex, url="http://a.com/path"))
+            assert result.status == 400 and not result.host_unavailable, "connection failure not reported"
+
+        result = await url_check._process_job(Job(id=uuid4().hex, url="http://a.com/other"))
+        assert result.status == 503 and result.host_unavailable, "open circuit didn't fail fast"
+
+
+@pytest.mark.consumer
+@pytest.mark.asyncio
+class TestTracing:
+    async def test_disabled(self):
+        flexmock(tracing, tracer=None)
+        fake_session = FakeAiohttpSession()
+        (flexmock(url_check)
+         .should_receive("ClientSession")
+         .with_args()
+         .and_return(fake_session))
+
+        result = await url_check._process_job(Job(id=uuid4().hex, url="http://a.com"))
+        assert result.timings is None, "timings recorded with tracing disabled"
+        assert "trace_request_ctx" not in fake_session.extra_kwargs, "trace context passed with tracing disabled"
+
+    async def test_phases_and_export(self, tmp_path):
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return web.Response(body=b"x" * 1024)
+
+        path = tmp_path / "spans.jsonl"
+        tracer = tracing.Tracer(exporter=tracing.SpanExporter(str(path)), sample_rate=1)
+        flexmock(tracing, tracer=tracer)
+
+        async with local_server(handler) as url:
+            result = await url_check._process_job(Job(id=uuid4().hex, url=url))
+        tracer._exporter.close()
+
+        timings = result.timings
+        assert result.status == 200 and timings, "timings not recorded"
+        assert timings.connect is not None and not timings.connection_reused, "connection not traced"
+        assert timings.ttfb >= 0.05 and timings.transfer is not None, "request phases not traced"
+        assert timings.total >= timings.ttfb + timings.connect, "wrong total"
+
+        request = json.loads(path.read_text().splitlines()[0])
+        spans = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        root = spans[0]
+        assert root["name"] == "GET" and len(root["traceId"]) == 32, "root span not exported"
+        assert {span["name"] for span in spans[1:]} >= {"connect", "ttfb", "transfer"}, "phase spans not exported"
+        assert all(span["parentSpanId"] == root["spanId"] for span in spans[1:]), "phase spans not parented"
+        assert int(root["endTimeUnixNano"]) > int(root["startTimeUnixNano"]), "wrong span times"
+
+    async def test_sampling(self, tmp_path):
+        tracer = tracing.Tracer(exporter=tracing.SpanExporter(str(tmp_path / "spans.jsonl")), sample_rate=0)
+        result = JobResult(job=Job(id=uuid4().hex, url="http://a.com"), status=200)
+        tracer.finish(result, tracing.RequestTrace())
+        assert result.timings is not None and tracer.exported == 0, "unsampled request exported"
+
+
+@pytest.mark.consumer
+class TestRedirectCache:
+    def test_resolve(self):
+        now = [0.0]
+        cache = redirects.RedirectCache(max_size=10, ttl=60, clock=lambda: now[0])
+        cache.add("http://a.com", "https://a.com")
+        cache.add("https://a.com", "https://www.a.com")
+
+        assert cache.resolve("http://a.com", max_hops=10) == ("https://www.a.com", 2), "chain not followed"
+        assert cache.resolve("http://a.com", max_hops=1) == ("https://a.com", 1), "max hops not respected"
+        assert cache.resolve("http://b.com", max_hops=10) == ("http://b.com", 0), "uncached url changed"
+        assert cache.info() == {"size": 2, "hits": 2, "hops_saved": 3}, "wrong stats"
+
+        now[0] = 61
+        assert cache.resolve("http://a.com", max_hops=10) == ("http://a.com", 0), "expired redirect used"
+        assert len(cache) == 1, "expired redirect not dropped"
+
+    def test_bounded_and_loops(self):
+        cache = redirects.RedirectCache(max_size=2)
+        cache.add("http://a.com", "http://b.com")
+        cache.add("http://b.com", "http://a.com")
+        assert cache.resolve("http://a.com", max_hops=10) == ("http://b.com", 1), "redirect loop followed"
+
+        cache.add("http://c.com", "http://d.com")
+        assert len(cache) == 2 and cache.resolve("http://a.com", max_hops=10)[1] == 0, "cache not bounded"
+
+
+@pytest.mark.consumer
+@pytest.mark.asyncio
+class TestProcessJobRedirects:
+    @staticmethod
+    async def handler(request):
+        targets = {"/a": ("/b", 301), "/b": ("/c", 302), "/loop": ("/loop", 308)}
+        if request.path in targets:
+            location, status = targets[request.path]
+            return web.Response(status=status, headers={"Location": location})
+        return web.Response(text="ok")
+
+    async def test_chain_and_cache(self):
+        flexmock(redirects, cache=redirects.RedirectCache())
+
+        async with local_server(self.handler) as url:
+            first = await url_check._process_job(Job(id=uuid4().hex, url=f"{url}/a"))
+            second = await url_check._process_job(Job(id=uuid4().hex, url=f"{url}/a"))
+
+        assert first.status == 200 and first.final_url == f"{url}/c", "redirects not followed"
+        assert [(hop.status, hop.url, hop.location) for hop in first.redirects] == [
+            (301, f"{url}/a", f"{url}/b"),
+            (302, f"{url}/b", f"{url}/c")], "wrong redirect chain"
+        assert first.redirect_hops_saved == 0
+
+        assert second.status == 200 and second.final_url == f"{url}/c", "cached redirect not followed"
+        assert second.redirect_hops_saved == 1, "permanent redirect not skipped"
+        assert [hop.url for hop in second.redirects] == [f"{url}/b"], "temporary redirect cached"
+
+    async def test_cache_key_normalized(self):
+        flexmock(redirects, cache=redirects.RedirectCache())
+
+        async with local_server(self.handler) as url:
+            # as recorded from the hop aiohttp reports for http://example.com/a
+            url_check._record_redirects(JobResult(job=None), [flexmock(status=301, url=URL("http://example.com/a"))],
+                                        URL(f"{url}/c"))
+            result = await url_check._process_job(Job(id=uuid4().hex, url="HTTP://EXAMPLE.COM:80/a"))
+
+        assert result.redirect_hops_saved == 1, "cache missed for an equivalent url"
+        assert result.status == 200 and result.final_url == f"{url}/c", "cached redirect not followed"
+
+    async def test_too_many_redirects(self):
+        flexmock(redirects, cache=redirects.RedirectCache())
+        flexmock(settings, MAX_REDIRECTS=3)
+
+        async with local_server(self.handler) as url:
+            result = await url_check._process_job(Job(id=uuid4().hex, url=f"{url}/loop"))
+
+        assert result.status == 308, "redirect status not reported"
+        assert len(result.redirects) == 3, "redirect chain not recorded"
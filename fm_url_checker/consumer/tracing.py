@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import random
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import TraceConfig, ClientSession
+
+from fm_url_checker.consumer import settings
+from fm_url_checker.consumer.models import JobResult, PhaseTimings
+
+log = logging.getLogger(__name__)
+
+
+class RequestTrace:
+    """ Phase marks of a single request, passed to the aiohttp signals as the trace_request_ctx """
+
+    def __init__(self):
+        self.start_ns = time.time_ns()
+        self.started = time.perf_counter()
+        self.marks: Dict[str, float] = {}
+        self.connection_reused = False
+        self.redirects = 0
+        self.error: str = None
+
+    def mark(self, name: str) -> None:
+        self.marks[name] = time.perf_counter()
+
+    def _between(self, start: str, end: str) -> Optional[float]:
+        if start in self.marks and end in self.marks:
+            return self.marks[end] - self.marks[start]
+        return None
+
+    def finish(self) -> PhaseTimings:
+        self.mark("finished")
+        # headers_sent is missing on aiohttp versions without the signal
+        request_sent = "headers_sent" if "headers_sent" in self.marks else "request_start"
+        return PhaseTimings(queued=self._between("queued_start", "queued_end"),
+                            dns=self._between("dns_start", "dns_end"),
+                            connect=self._between("connect_start", "connect_end"),
+                            ttfb=self._between(request_sent, "response_start"),
+                            transfer=self._between("response_start", "finished"),
+                            total=self.marks["finished"] - self.started,
+                            connection_reused=self.connection_reused,
+                            redirects=self.redirects)
+
+    def _ns(self, mark: str) -> int:
+        return self.start_ns + int((self.marks[mark] - self.started) * 1e9)
+
+
+def _marker(name: str):
+    async def on_signal(session: ClientSession, context: SimpleNamespace, params) -> None:
+        if isinstance(context.trace_request_ctx, RequestTrace):
+            context.trace_request_ctx.mark(name)
+    return on_signal
+
+
+async def _on_connection_reuse(session: ClientSession, context: SimpleNamespace, params) -> None:
+    if isinstance(context.trace_request_ctx, RequestTrace):
+        context.trace_request_ctx.connection_reused = True
+
+
+async def _on_redirect(session: ClientSession, context: SimpleNamespace, params) -> None:
+    if isinstance(context.trace_request_ctx, RequestTrace):
+        context.trace_request_ctx.redirects += 1
+
+
+async def _on_exception(session: ClientSession, context: SimpleNamespace, params) -> None:
+    if isinstance(context.trace_request_ctx, RequestTrace):
+        context.trace_request_ctx.error = f"{params.exception.__class__.__name__}: {params.exception}"
+
+
+def create_trace_config() -> TraceConfig:
+    trace_config = TraceConfig()
+    trace_config.on_request_start.append(_marker("request_start"))
+    trace_config.on_connection_queued_start.append(_marker("queued_start"))
+    trace_config.on_connection_queued_end.append(_marker("queued_end"))
+    trace_config.on_dns_resolvehost_start.append(_marker("dns_start"))
+    trace_config.on_dns_resolvehost_end.append(_marker("dns_end"))
+    # aiohttp has no separate TLS signal, connect covers the TCP and TLS handshakes
+    trace_config.on_connection_create_start.append(_marker("connect_start"))
+    trace_config.on_connection_create_end.append(_marker("connect_end"))
+    trace_config.on_connection_reuseconn.append(_on_connection_reuse)
+    if hasattr(trace_config, "on_request_headers_sent"):
+        trace_config.on_request_headers_sent.append(_marker("headers_sent"))
+    trace_config.on_request_end.append(_marker("response_start"))
+    trace_config.on_request_redirect.append(_on_redirect)
+    trace_config.on_request_exception.append(_on_exception)
+    return trace_config
+
+
+def _attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class SpanExporter:
+    """ Appends spans to a local file, one OTLP/JSON ExportTraceServiceRequest per line """
+
+    def __init__(self, path: str, service_name: str = settings.NAME):
+        self._path = path
+        self._resource = {"attributes": [_attribute("service.name", service_name),
+                                         _attribute("process.pid", os.getpid())]}
+        self._file = None
+
+    def _span(self, trace_id: str, span_id: str, parent_id: str, name: str, start: int, end: int,
+              attributes: List[Dict], error: str = None) -> Dict:
+        span = {"traceId": trace_id,
+                "spanId": span_id,
+                "name": name,
+                "kind": 3,  # SPAN_KIND_CLIENT
+                "startTimeUnixNano": str(start),
+                "endTimeUnixNano": str(end),
+                "attributes": attributes,
+                "status": {"code": 2, "message": error} if error else {"code": 1}}
+        if parent_id:
+            span["parentSpanId"] = parent_id
+        return span
+
+    def spans(self, result: JobResult, trace: RequestTrace) -> List[Dict]:
+        trace_id = os.urandom(16).hex()
+        root_id = os.urandom(8).hex()
+        timings = result.timings
+        spans = [self._span(trace_id, root_id, None, "GET", trace.start_ns, trace._ns("finished"),
+                            [_attribute("http.method", "GET"),
+                             _attribute("http.url", result.job.url),
+                             _attribute("http.status_code", result.status or 0),
+                             _attribute("http.response_content_length", result.size or 0),
+                             _attribute("job.id", result.job.id),
+                             _attribute("net.connection_reused", timings.connection_reused),
+                             _attribute("http.redirect_count", timings.redirects)],
+                            error=trace.error)]
+        phases: List[Tuple[str, str, str]] = [("queued", "queued_start", "queued_end"),
+                                              ("dns", "dns_start", "dns_end"),
+                                              ("connect", "connect_start", "connect_end"),
+                                              ("ttfb", "headers_sent" if "headers_sent" in trace.marks
+                                               else "request_start", "response_start"),
+                                              ("transfer", "response_start", "finished")]
+        for name, start, end in phases:
+            if start in trace.marks and end in trace.marks:
+                spans.append(self._span(trace_id, os.urandom(8).hex(), root_id, name,
+                                        trace._ns(start), trace._ns(end), []))
+        return spans
+
+    def export(self, result: JobResult, trace: RequestTrace) -> None:
+        if self._file is None:
+            self._file = open(self._path, "a", encoding="utf8")
+        request = {"resourceSpans": [{"resource": self._resource,
+                                      "scopeSpans": [{"scope": {"name": __name__},
+                                                      "spans": self.spans(result, trace)}]}]}
+        self._file.write(json.dumps(request) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Tracer:
+    """ Opt-in request phase tracing, every traced request gets its timings, `sample_rate` of them are exported """
+
+    def __init__(self, exporter: SpanExporter = None, sample_rate: float = 1.0):
+        self.trace_config = create_trace_config()
+        self._exporter = exporter
+        self._sample_rate = sample_rate
+        self.exported = 0
+
+    def finish(self, result: JobResult, trace: RequestTrace) -> None:
+        result.timings = trace.finish()
+        if self._exporter and random.random() < self._sample_rate:
+            try:
+                self._exporter.export(result, trace)
+                self.exported += 1
+            except OSError as e:
+                log.error(f"Failed to export spans: {e}")
+
+    def info(self) -> Dict[str, int]:
+        return {"exported": self.exported}
+
+
+tracer: Optional[Tracer] = None
+if settings.TRACING_ENABLED:
+    tracer = Tracer(exporter=SpanExporter(settings.TRACING_EXPORT_PATH) if settings.TRACING_EXPORT_PATH else None,
+                    sample_rate=settings.TRACING_SAMPLE_RATE)
@@ -1,12 +1,21 @@
+import asyncio
+import codecs
 import json
 import logging
+import time
+from dataclasses import asdict
 from json import JSONDecodeError
+from typing import Sequence, Tuple
+from urllib.parse import urlsplit
 
 import re
 from aio_pika import IncomingMessage
-from aiohttp import ClientSession, ClientOSError
+from aiohttp import ClientSession, ClientOSError, ClientResponse, ClientConnectorError, TooManyRedirects
+from yarl import URL
 
-from fm_url_checker.consumer.models import Job, JobResult, ValidationError
+from fm_url_checker.consumer import health, memory, settings, concurrency, circuit_breaker, tracing, redirects
+from fm_url_checker.consumer.memory import MemoryBudgetExhausted
+from fm_url_checker.consumer.models import Job, JobResult, ValidationError, Redirect
 
 log = logging.getLogger(__name__)
 
@@ -31,27 +40,111 @@ def _validate_message(message: IncomingMessage) -> Job:
     return Job(id=job_id, url=url)
 
 
-async def _process_job(job: Job) -> JobResult:
-    """ Main job processing """
+async def _read_size(response: ClientResponse) -> Tuple[int, bool]:
+    """
+    Counts the decoded characters chunk by chunk, only a chunk and its decoded text are held at a time.
+    Returns the decoded body length and whether it was truncated at MAX_RESPONSE_SIZE bytes.
+    """
+
+    chunk_size = settings.READ_CHUNK_SIZE
+    decoder = codecs.getincrementaldecoder(response.charset or "utf8")(errors="replace")
+    reserved = memory.fetch_reservation()
+    await memory.budget.reserve(reserved)
+    read = 0
+    size = 0
+    truncated = False
+    try:
+        while read < settings.MAX_RESPONSE_SIZE:
+            # the last read is cut short so no more than MAX_RESPONSE_SIZE is read
+            chunk = await response.content.read(min(chunk_size, settings.MAX_RESPONSE_SIZE - read))
+            if not chunk:
+                break
+            read += len(chunk)
+            # Body is automatically unzipped for gzip/deflate encodings
+            size += len(decoder.decode(chunk))
+        else:
+            truncated = not response.content.at_eof()
+        # a character cut by the truncation counts as a replacement character
+        return size + len(decoder.decode(b"", final=True)), truncated
+    finally:
+        memory.budget.release(reserved)
+
+
+def _cache_key(url) -> str:
+    """ Redirect cache key, normalized like the hop urls aiohttp reports (case, default port, quoting, IDNA) """
+
+    try:
+        return str(URL(url))
+    except ValueError:
+        return str(url)
 
-    result = JobResult(job=job)
-    async with ClientSession() as session:
-        try:
-            async with session.get(job.url) as response:
-                result.status = response.status
 
-                # Body is automatically unzipped for gzip/deflate encodings
-                result.size = len(await response.text())
+def _record_redirects(result: JobResult, history: Sequence[ClientResponse], final_url) -> None:
+    """ Records the redirect chain in the result and caches its permanent hops """
 
-                # Simulate long running tasks, see readme
-                # await asyncio.sleep(10)
+    locations = [str(hop.url) for hop in history[1:]] + [str(final_url)]
+    for hop, location in zip(history, locations):
+        result.redirects.append(Redirect(status=hop.status, url=str(hop.url), location=location))
+        if hop.status in redirects.PERMANENT_REDIRECTS:
+            redirects.cache.add(_cache_key(hop.url), location)
+    result.final_url = str(final_url)
 
-        except ClientOSError as e:
-            log.error(e)
-            result.status = 400
-        except Exception as e:
-            log.exception(f"Unhandled error occurred: {e}")
-            result.status = 500
+
+async def _process_job(job: Job) -> JobResult:
+    """ Main job processing """
+
+    result = JobResult(job=job)
+    url, result.redirect_hops_saved = redirects.cache.resolve(_cache_key(job.url), max_hops=settings.MAX_REDIRECTS)
+    host = urlsplit(url).hostname or ""
+    if not circuit_breaker.breaker.allow(host):
+        result.status = 503
+        result.host_unavailable = True
+        return result
+
+    tracer = tracing.tracer
+    trace = tracing.RequestTrace() if tracer else None
+    session_kwargs = {"trace_configs": [tracer.trace_config]} if tracer else {}
+    request_kwargs = {"trace_request_ctx": trace} if tracer else {}
+
+    failed = False
+    async with concurrency.controller.slot():
+        started = time.monotonic()
+        async with ClientSession(**session_kwargs) as session:
+            try:
+                async with session.get(url, max_redirects=settings.MAX_REDIRECTS, **request_kwargs) as response:
+                    result.status = response.status
+                    _record_redirects(result, response.history, response.url)
+                    result.size, result.truncated = await _read_size(response)
+
+                    # Simulate long running tasks, see readme
+                    # await asyncio.sleep(10)
+
+            except MemoryBudgetExhausted:
+                raise
+            except TooManyRedirects as e:
+                log.warning(f"Gave up after {len(e.history)} redirects", extra={"job_id": job.id, "url": job.url})
+                last = e.history[-1]
+                _record_redirects(result, e.history, last.url.join(URL(last.headers.get("Location", ""))))
+                result.status = last.status
+            except (ClientConnectorError, asyncio.TimeoutError) as e:
+                log.error(e)
+                circuit_breaker.breaker.record_failure(host)
+                result.status = 400
+                failed = True
+            except ClientOSError as e:
+                log.error(e)
+                result.status = 400
+                failed = True
+            except Exception as e:
+                log.exception(f"Unhandled error occurred: {e}")
+                result.status = 500
+                failed = True
+
+        if trace:
+            tracer.finish(result, trace)
+        concurrency.controller.record(time.monotonic() - started, error=failed)
+        if not failed:
+            circuit_breaker.breaker.record_success(host)
 
     return result
 
@@ -67,11 +160,23 @@ async def received_job(message: IncomingMessage) -> None:
         message.reject(requeue=False)
         return
 
-    result = await _process_job(job)
+    try:
+        result = await _process_job(job)
+    except MemoryBudgetExhausted as e:
+        log.warning(f"{e}. Requeuing job", extra={"job_id": job.id, "url": job.url})
+        message.reject(requeue=True)
+        return
     message.ack()
+    health.state.job_processed()
 
     log.info("Job completed",
              extra={"job_id": result.job.id,
                     "url": result.job.url,
                     "status": result.status,
-                    "size": result.size})
+                    "size": result.size,
+                    "truncated": result.truncated,
+                    "host_unavailable": result.host_unavailable,
+                    "final_url": result.final_url,
+                    "redirects": len(result.redirects),
+                    "redirect_hops_saved": result.redirect_hops_saved,
+                    **({"timings": asdict(result.timings)} if result.timings else {})})
@@ -1,19 +1,20 @@
-import json
 import logging
 from typing import Dict, Tuple, Union
 from uuid import uuid4
 
 import re
 import rfc3987
-from pika import BlockingConnection, ConnectionParameters, PlainCredentials, BasicProperties
-from pika.channel import Channel
 
-from fm_url_checker.producer import settings
+from fm_url_checker.producer import settings, dedup, transport
 
 log = logging.getLogger(__name__)
 
 DOMAIN_REX = re.compile(r"\w+\.\w+")
 
+# per process, each uwsgi worker keeps its own window
+_dedup_filter = dedup.from_settings()
+_transport = transport.from_settings()
+
 
 def _validate_url(url: str) -> None:
     """ Basic url validation """
@@ -29,26 +30,29 @@ def _validate_url(url: str) -> None:
         raise ValueError("Invalid domain specified")
 
 
-def _push_job(url: str) -> str:
+def _publish(routing_key: str, body: Dict, headers: Dict[str, str]) -> None:
+    """ Publishes a single json message to the job exchange through the configured transport """
+
+    _transport.publish(routing_key=routing_key, body=body, headers=headers)
+
+
+def _push_job(url: str, job_id: str = None) -> str:
     """ Simple method that pushes a job to a rabbitmq queue """
 
-    connection = BlockingConnection(ConnectionParameters(host=settings.RABBITMQ_HOST,
-                                                         port=settings.RABBITMQ_PORT,
-                                                         virtual_host=settings.RABBITMQ_VHOST,
-                                                         credentials=PlainCredentials(username=settings.RABBITMQ_USER,
-                                                                                      password=settings.RABBITMQ_PASS)))
-    channel: Channel = connection.channel()
-    job_id = uuid4().hex
-    channel.basic_publish(exchange=settings.RABBITMQ_JOB_EXCHANGE,
-                          routing_key=settings.RABBITMQ_JOB_ROUTING_KEY,
-                          body=json.dumps({"url": url}),
-                          properties=BasicProperties(content_type="application/json",
-                                                     content_encoding="utf8",
-                                                     headers={"job_id": job_id}))
-    connection.close()
+    job_id = job_id or uuid4().hex
+    _publish(routing_key=settings.RABBITMQ_JOB_ROUTING_KEY, body={"url": url}, headers={"job_id": job_id})
     return job_id
 
 
+def _push_monitor(action: str, url: str, interval: int = None) -> None:
+    """ Sends a monitor (un)registration to the scheduler """
+
+    body = {"url": url}
+    if interval is not None:
+        body["interval"] = interval
+    _publish(routing_key=settings.RABBITMQ_MONITOR_QUEUE, body=body, headers={"action": action})
+
+
 def _problem_response(title: str,
                       problem_type: str,
                       detail: str = None,
@@ -77,10 +81,69 @@ def post(body: Dict[str, str]) -> Tuple[Dict[str, str], int]:
         _validate_url(url)
     except ValueError:
         log.info("Invalid URL received", extra=body)
-        return _problem_response(title="Invalid URL provided",
-                                 problem_type="fm/error/validation",
-                                 detail=f"The specified URL: '{url}' is malformed, expecting rfc3987 formatted url.",
-                                 status=400,
-                                 instance="fm/error/validation/url")
+        return _invalid_url_response(url)
+
+    if _dedup_filter is not None:
+        job_id, duplicate = _dedup_filter.check(url)
+        if duplicate:
+            log.info("Duplicate url within the dedup window, not queueing", extra={"url": url, "job_id": job_id})
+            return {"id": job_id}, 200
+        job_id = _push_job(url, job_id=job_id)
+        # only once queued, a failed publish must not turn its retries into duplicates
+        _dedup_filter.add(url)
+        return {"id": job_id}, 201
+
     job_id = _push_job(url)
     return {"id": job_id}, 201
+
+
+def _invalid_url_response(url: str) -> Tuple[Dict[str, Union[str, int]], int]:
+    return _problem_response(title="Invalid URL provided",
+                             problem_type="fm/error/validation",
+                             detail=f"The specified URL: '{url}' is malformed, expecting rfc3987 formatted url.",
+                             status=400,
+                             instance="fm/error/validation/url")
+
+
+def post_monitor(body: Dict[str, Union[str, int]]) -> Tuple[Dict[str, Union[str, int]], int]:
+    """ Register a url to be checked on an interval """
+
+    log.info("Received new monitor", extra=body)
+    url = body["url"]
+    interval = body["interval"]
+    try:
+        _validate_url(url)
+    except ValueError:
+        log.info("Invalid URL received", extra=body)
+        return _invalid_url_response(url)
+    if not settings.MONITOR_MIN_INTERVAL <= interval <= settings.MONITOR_MAX_INTERVAL:
+        return _problem_response(title="Invalid interval provided",
+                                 problem_type="fm/error/validation",
+                                 detail=f"The interval must be between {settings.MONITOR_MIN_INTERVAL} and "
+                                        f"{settings.MONITOR_MAX_INTERVAL} seconds.",
+                                 status=400,
+                                 instance="fm/error/validation/interval")
+    _push_monitor("register", url, interval)
+    return {"url": url, "interval": interval}, 202
+
+
+def delete_monitor(url: str) -> Tuple[None, int]:
+    """ Stop checking a url on an interval """
+
+    log.info("Removing monitor", extra={"url": url})
+    _push_monitor("unregister", url)
+    return None, 202
+
+
+def live() -> Tuple[Dict[str, bool], int]:
+    """ Liveness probe, the process is up and serving requests """
+
+    return {"live": True}, 200
+
+
+def ready() -> Tuple[Dict[str, bool], int]:
+    """ Readiness probe, jobs can only be queued while the broker (or the embedded consumer) is up """
+
+    if _transport.ready():
+        return {"ready": True}, 200
+    return {"ready": False}, 503
@@ -0,0 +1,43 @@
+import logging
+import socket
+import sys
+import time
+
+from fm_url_checker.producer import settings
+
+log = logging.getLogger(__name__)
+
+
+def probe_broker(timeout: float = 1) -> bool:
+    """ Checks whether the broker accepts TCP connections, without doing the AMQP handshake """
+
+    try:
+        with socket.create_connection((settings.RABBITMQ_HOST, settings.RABBITMQ_PORT), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def wait_for_broker(initial_delay: float = 0.1, max_delay: float = 5, timeout: float = 60) -> bool:
+    """ Probes the broker with an exponential back-off until it is reachable or the timeout is exceeded """
+
+    started = time.monotonic()
+    delay = initial_delay
+    attempt = 1
+    while not probe_broker(timeout=max(delay, 1)):
+        elapsed = time.monotonic() - started
+        if elapsed + delay > timeout:
+            log.error(f"Broker unreachable after {attempt} attempts ({elapsed:.2f}s)")
+            return False
+        log.info(f"Broker not ready, retrying in {delay:.2f}s", extra={"attempt": attempt})
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+        attempt += 1
+
+    log.info(f"Broker ready after {attempt} attempts ({time.monotonic() - started:.2f}s)")
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if wait_for_broker(max_delay=settings.RABBITMQ_PROBE_MAX_DELAY,
+                                  timeout=settings.RABBITMQ_STARTUP_TIMEOUT) else 1)
@@ -0,0 +1,391 @@
+"""
+Bulk enqueue, streams a URL file straight to the job queue instead of going through the API.
+
+    python fm_url_checker/producer/bulk.py urls.csv.gz --column url --manifest urls.manifest
+
+Plain text (one url per line) and CSV files are read line by line, gzip compressed ones are decompressed on the fly.
+URLs are validated in a process pool and published over a single channel with publisher confirms, up to --window
+messages unconfirmed at a time. Every confirmed job and every rejected url is appended to the manifest, in input
+order, as a `job_id,url,error` row.
+
+The checkpoint next to the manifest holds the input offset up to which every line is confirmed and in the manifest.
+After a crash the same command resumes from there, messages published but not yet confirmed at the time are published
+again (at least once). Memory use depends on --window, --batch-size and --processes only, not on the file size.
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Deque, Dict, Iterator, List, Optional, TextIO, Tuple
+from uuid import uuid4
+
+from pika import BasicProperties, ConnectionParameters, SelectConnection, spec
+from pika.channel import Channel
+
+from fm_url_checker.producer import settings
+from fm_url_checker.producer.api import _validate_url
+from fm_url_checker.producer.transport import connection_parameters
+
+log = logging.getLogger(__name__)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# (offset after the line, url, validation error)
+Record = Tuple[int, str, Optional[str]]
+
+
+def open_source(path: str) -> BinaryIO:
+    """ Opens a url file for binary reading, gzip files are detected by their magic number """
+
+    with open(path, "rb") as source:
+        compressed = source.read(2) == GZIP_MAGIC
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+def is_csv(path: str) -> bool:
+    return (path[:-3] if path.endswith(".gz") else path).lower().endswith(".csv")
+
+
+def read_urls(path: str,
+              csv_format: bool = False,
+              column: str = "0",
+              header: bool = True,
+              offset: int = 0) -> Iterator[Tuple[int, str]]:
+    """
+    Yields (offset after the line, url) from `offset` on, blank lines are skipped. A CSV `column` is either an index or
+    the name of a header column, the first row is skipped as the header unless `header` is false. Offsets are
+    positions in the decompressed stream.
+    """
+
+    with open_source(path) as source:
+        index = 0
+        if csv_format:
+            if not header and not column.isdigit():
+                raise ValueError(f"Column {column} given by name but {path} has no header")
+            names = next(csv.reader([source.readline().decode("utf8")]), []) if header else []
+            if column.isdigit():
+                index = int(column)
+            elif column in names:
+                index = names.index(column)
+            else:
+                raise ValueError(f"No column {column} in the header of {path}")
+        if offset > source.tell():
+            # gzip streams seek forward by decompressing, without buffering the skipped part
+            source.seek(offset)
+
+        while True:
+            line = source.readline()
+            if not line:
+                return
+            url = line.decode("utf8", errors="replace").strip()
+            if csv_format and url:
+                row = next(csv.reader([url]), [])
+                url = row[index].strip() if index < len(row) else ""
+            if url:
+                yield source.tell(), url
+
+
+def _validate_batch(batch: List[Tuple[int, str]]) -> List[Record]:
+    records = []
+    for offset, url in batch:
+        try:
+            _validate_url(url)
+            records.append((offset, url, None))
+        except (ValueError, TypeError) as e:
+            records.append((offset, url, str(e) or "Invalid URL"))
+    return records
+
+
+def _batches(urls: Iterator[Tuple[int, str]], size: int) -> Iterator[List[Tuple[int, str]]]:
+    batch = []
+    for url in urls:
+        batch.append(url)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def validate(urls: Iterator[Tuple[int, str]], processes: int = None, batch_size: int = 1000) -> Iterator[Record]:
+    """ Validates the urls in input order, in a pool of `processes` (inline if 0) with 2 batches per process queued """
+
+    if processes == 0:
+        for batch in _batches(urls, batch_size):
+            yield from _validate_batch(batch)
+        return
+
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        queued: Deque[Future] = deque()
+        for batch in _batches(urls, batch_size):
+            queued.append(pool.submit(_validate_batch, batch))
+            if len(queued) >= 2 * processes:
+                yield from queued.popleft().result()
+        while queued:
+            yield from queued.popleft().result()
+
+
+class Checkpoint:
+    """ Input offset up to which every line is in the manifest, with the manifest size at that point """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Tuple[int, int]:
+        try:
+            with open(self.path) as checkpoint:
+                offset, manifest_size = checkpoint.read().split()
+                return int(offset), int(manifest_size)
+        except FileNotFoundError:
+            return 0, 0
+
+    def save(self, offset: int, manifest_size: int) -> None:
+        # replaced atomically, a crash leaves either the previous or the new checkpoint
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as checkpoint:
+            checkpoint.write(f"{offset} {manifest_size}\n")
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(temporary, self.path)
+
+
+@dataclass
+class _Entry:
+    offset: int
+    url: str
+    error: str = ""
+    job_id: str = ""
+    confirmed: bool = False
+
+
+class BulkPublisher:
+    """
+    Publishes validated records over one channel in confirm mode with at most `window` records in flight. Records are
+    retired in input order once confirmed (or rejected), so the checkpoint never moves past an unconfirmed message.
+    """
+
+    def __init__(self,
+                 records: Iterator[Record],
+                 manifest: TextIO,
+                 checkpoint: Checkpoint,
+                 parameters: ConnectionParameters,
+                 window: int = 1000,
+                 checkpoint_every: int = 10000,
+                 offset: int = 0):
+        self._records = records
+        self._manifest = manifest
+        self._writer = csv.writer(manifest)
+        self._checkpoint = checkpoint
+        self._parameters = parameters
+        self._window = window
+        self._checkpoint_every = checkpoint_every
+        self._connection: SelectConnection = None
+        self._channel: Channel = None
+        self._pending: Deque[_Entry] = deque()
+        self._unconfirmed: Dict[int, _Entry] = {}
+        self._nacked: Deque[_Entry] = deque()
+        self._delivery_tag = 0
+        self._exhausted = False
+        self._closing = False
+        self._error: str = None
+        self._since_checkpoint = 0
+        self.offset = offset
+        self.published = 0
+        self.rejected = 0
+        self.republished = 0
+
+    def run(self) -> None:
+        self._connection = SelectConnection(self._parameters,
+                                            on_open_callback=self._on_open,
+                                            on_open_error_callback=self._on_failure,
+                                            on_close_callback=self._on_closed)
+        try:
+            self._connection.ioloop.start()
+        finally:
+            self._save()
+        if self._error:
+            raise ConnectionError(f"Bulk enqueue stopped at offset {self.offset}: {self._error}")
+
+    def _on_open(self, connection: SelectConnection) -> None:
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_channel_open(self, channel: Channel) -> None:
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        # Confirm.Select goes out before the first publish, every delivery tag is confirmed
+        channel.confirm_delivery(self._on_confirm)
+        self._pump()
+
+    def _on_failure(self, connection: SelectConnection, error=None) -> None:
+        self._error = str(error)
+        connection.ioloop.stop()
+
+    def _on_channel_closed(self, channel: Channel, *reason) -> None:
+        if not self._closing:
+            self._error = f"Channel closed: {reason}"
+            self._close()
+
+    def _on_closed(self, connection: SelectConnection, *reason) -> None:
+        if not self._closing and not self._error:
+            self._error = f"Connection closed: {reason}"
+        connection.ioloop.stop()
+
+    def _close(self) -> None:
+        self._closing = True
+        if self._connection.is_open:
+            self._connection.close()
+
+    def _publish(self, entry: _Entry) -> None:
+        entry.job_id = entry.job_id or uuid4().hex
+        self._channel.basic_publish(exchange=settings.RABBITMQ_JOB_EXCHANGE,
+                                    routing_key=settings.RABBITMQ_JOB_ROUTING_KEY,
+                                    body=json.dumps({"url": entry.url}),
+                                    properties=BasicProperties(content_type="application/json",
+                                                               content_encoding="utf8",
+                                                               headers={"job_id": entry.job_id}))
+        self._delivery_tag += 1
+        self._unconfirmed[self._delivery_tag] = entry
+
+    def _pump(self) -> None:
+        """ Publishes until the window is full, nacked messages first """
+
+        while self._nacked and len(self._unconfirmed) < self._window:
+            self._publish(self._nacked.popleft())
+            self.republished += 1
+
+        while not self._exhausted and len(self._pending) < self._window:
+            try:
+                offset, url, error = next(self._records)
+            except StopIteration:
+                self._exhausted = True
+                break
+            entry = _Entry(offset=offset, url=url, error=error or "")
+            self._pending.append(entry)
+            if error:
+                entry.confirmed = True
+                self.rejected += 1
+                self._retire()
+            else:
+                self._publish(entry)
+
+        if self._exhausted and not self._unconfirmed and not self._nacked:
+            self._retire()
+            self._close()
+
+    def _on_confirm(self, method_frame) -> None:
+        method = method_frame.method
+        if method.multiple:
+            tags = [tag for tag in self._unconfirmed if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        for tag in tags:
+            entry = self._unconfirmed.pop(tag, None)
+            if entry is None:
+                continue
+            if isinstance(method, spec.Basic.Ack):
+                entry.confirmed = True
+                self.published += 1
+            else:
+                log.warning("Message nacked by the broker, publishing again", extra={"url": entry.url})
+                self._nacked.append(entry)
+
+        self._retire()
+        self._pump()
+
+    def _retire(self) -> None:
+        while self._pending and self._pending[0].confirmed:
+            entry = self._pending.popleft()
+            self._writer.writerow([entry.job_id, entry.url, entry.error])
+            self.offset = entry.offset
+            self._since_checkpoint += 1
+            if self._since_checkpoint >= self._checkpoint_every:
+                self._save()
+
+    def _save(self) -> None:
+        self._manifest.flush()
+        os.fsync(self._manifest.fileno())
+        self._checkpoint.save(self.offset, self._manifest.tell())
+        self._since_checkpoint = 0
+        log.info("Checkpoint saved", extra={"offset": self.offset,
+                                            "published": self.published,
+                                            "rejected": self.rejected})
+
+
+def enqueue(path: str,
+            manifest_path: str,
+            csv_format: bool = None,
+            column: str = "0",
+            header: bool = True,
+            processes: int = None,
+            batch_size: int = 1000,
+            window: int = 1000,
+            checkpoint_every: int = 10000,
+            parameters: ConnectionParameters = None) -> BulkPublisher:
+    """ Enqueues every url in the file, resuming from the manifest checkpoint if there is one """
+
+    checkpoint = Checkpoint(f"{manifest_path}.checkpoint")
+    offset, manifest_size = checkpoint.load()
+    if offset:
+        log.info(f"Resuming {path} from offset {offset}")
+    if os.path.exists(manifest_path):
+        # rows written after the last checkpoint are published again
+        os.truncate(manifest_path, manifest_size)
+
+    if csv_format is None:
+        csv_format = is_csv(path)
+    records = validate(read_urls(path, csv_format=csv_format, column=column, header=header, offset=offset),
+                       processes=processes,
+                       batch_size=batch_size)
+    try:
+        with open(manifest_path, "a", encoding="utf8", newline="") as manifest:
+            publisher = BulkPublisher(records,
+                                      manifest,
+                                      checkpoint,
+                                      parameters=parameters or connection_parameters(),
+                                      window=window,
+                                      checkpoint_every=checkpoint_every,
+                                      offset=offset)
+            publisher.run()
+    finally:
+        records.close()
+    return publisher
+
+
+def main(argv: List[str] = None) -> BulkPublisher:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="url file, plain text or CSV, optionally gzip compressed")
+    parser.add_argument("--manifest", help="job id manifest, the checkpoint is kept next to it "
+                                           "(default: <path>.manifest)")
+    parser.add_argument("--format", choices=("text", "csv"), help="detected from the file name if not given")
+    parser.add_argument("--column", default="0", help="CSV column holding the url, index or header name")
+    parser.add_argument("--no-header", dest="header", action="store_false",
+                        help="the CSV has no header row, every row holds a url")
+    parser.add_argument("--processes", type=int, help="validation processes, 0 validates inline (default: cpus)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="urls per validation batch")
+    parser.add_argument("--window", type=int, default=1000, help="max unconfirmed messages")
+    parser.add_argument("--checkpoint-every", type=int, default=10000, help="lines between checkpoints")
+    args = parser.parse_args(argv)
+
+    publisher = enqueue(args.path,
+                        manifest_path=args.manifest or f"{args.path}.manifest",
+                        csv_format=None if args.format is None else args.format == "csv",
+                        column=args.column,
+                        header=args.header,
+                        processes=args.processes,
+                        batch_size=args.batch_size,
+                        window=args.window,
+                        checkpoint_every=args.checkpoint_every)
+    print(f"published: {publisher.published}, rejected: {publisher.rejected}, "
+          f"republished: {publisher.republished}, offset: {publisher.offset}")
+    return publisher
+
+
+if __name__ == '__main__':
+    main()
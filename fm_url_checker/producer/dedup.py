@@ -0,0 +1,138 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from fm_url_checker.producer import settings
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """ Lowercases the scheme and host, drops default ports and fragments so equivalent URLs hash the same """
+
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{parts.port}"
+    if parts.username:
+        netloc = f"{parts.username}{':' + parts.password if parts.password else ''}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+class BloomFilter:
+    """ Fixed size Bloom filter, sized from the expected number of items and the target false positive rate """
+
+    def __init__(self, capacity: int, error_rate: float):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("Capacity must be positive and the error rate between 0 and 1")
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def add(self, key: bytes) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def clear(self) -> None:
+        self._bits = bytearray(len(self._bits))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+
+class DedupFilter:
+    """
+    Time-bucketed duplicate filter over normalized URLs.
+
+    The window is split in `buckets` rotating Bloom filters, each sized for its share of `capacity`, so memory is
+    fixed regardless of traffic. A lookup goes through every bucket, so each one is sized for `error_rate / buckets`
+    to keep the rate over the whole window at `error_rate`. Job ids are derived from the URL and the bucket it was
+    first seen in, which lets a duplicate get the id of the job that was already queued without storing any ids. A
+    false positive means a URL gets an aliased id without being queued.
+
+    check() only looks the URL up, add() records it once its job was actually queued, so a failed publish can be
+    retried.
+
+    Every process keeps its own filter, ids are salted per process so the same URL queued by two uwsgi workers gets
+    two distinct job ids.
+    """
+
+    def __init__(self,
+                 window: float,
+                 capacity: int,
+                 error_rate: float = 0.001,
+                 buckets: int = 4,
+                 clock: Callable[[], float] = time.time):
+        self._span = window / buckets
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._filters: List[BloomFilter] = [BloomFilter(capacity=max(1, capacity // buckets),
+                                                        error_rate=error_rate / buckets)
+                                            for _ in range(buckets)]
+        self._bucket_ids: List[Optional[int]] = [None] * buckets
+        self._salt = os.urandom(8)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(bloom.nbytes for bloom in self._filters)
+
+    def _job_id(self, bucket_id: int, key: bytes) -> str:
+        # the pid tells apart the uwsgi workers forked after the filter (and its salt) was created
+        return hashlib.blake2b(b"%d:%d:%s" % (os.getpid(), bucket_id, key),
+                               key=self._salt,
+                               digest_size=16).hexdigest()
+
+    def _current(self) -> int:
+        """ Id of the current bucket, its filter is cleared when the bucket comes round again """
+
+        current = int(self._clock() // self._span)
+        index = current % len(self._filters)
+        if self._bucket_ids[index] != current:
+            self._filters[index].clear()
+            self._bucket_ids[index] = current
+        return current
+
+    def check(self, url: str) -> Tuple[str, bool]:
+        """ Returns the job id to use for the URL and whether it's a duplicate that shouldn't be queued again """
+
+        key = normalize_url(url).encode("utf8")
+        buckets = len(self._filters)
+        with self._lock:
+            current = self._current()
+            # oldest first, a URL keeps the id of the bucket it was first seen in
+            for bucket_id in range(current - buckets + 1, current + 1):
+                position = bucket_id % buckets
+                if self._bucket_ids[position] == bucket_id and key in self._filters[position]:
+                    return self._job_id(bucket_id, key), True
+        return self._job_id(current, key), False
+
+    def add(self, url: str) -> None:
+        """ Records the URL as queued in the current bucket """
+
+        key = normalize_url(url).encode("utf8")
+        with self._lock:
+            self._filters[self._current() % len(self._filters)].add(key)
+
+
+def from_settings() -> Optional[DedupFilter]:
+    if settings.DEDUP_WINDOW <= 0:
+        return None
+    return DedupFilter(window=settings.DEDUP_WINDOW,
+                       capacity=settings.DEDUP_CAPACITY,
+                       error_rate=settings.DEDUP_ERROR_RATE,
+                       buckets=settings.DEDUP_BUCKETS)
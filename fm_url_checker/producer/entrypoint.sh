@@ -1,5 +1,11 @@
 #!/bin/sh
 
-echo "Waiting for RabbitMQ to start"
-sleep 10
+if [ "${TRANSPORT:-amqp}" = "amqp" ]; then
+  echo "Waiting for RabbitMQ to start"
+  python fm_url_checker/producer/broker.py || exit 1
+fi
+if [ "${TRANSPORT:-amqp}" = "embedded" ]; then
+  # the embedded consumer's queues, journals and scheduler store belong to a single process
+  exec uwsgi --ini fm_url_checker/producer/conf.ini --processes 1
+fi
 exec uwsgi --ini fm_url_checker/producer/conf.ini
@@ -0,0 +1,294 @@
+"""
+Load generator for the producer API, replays a URL file (or synthetic URLs) against POST /check either at a fixed
+rate or at a fixed concurrency and reports the latency distribution, errors by problem type and throughput.
+
+    python fm_url_checker/producer/loadgen.py --target http://localhost:8080 --rate 500 --duration 30
+    python fm_url_checker/producer/loadgen.py --local --concurrency 16 --requests 5000
+
+With --local a stand-in broker is started and the producer is spawned against it, so the run measures the producer
+on its own (see standin_broker.py).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import shlex
+import socket
+import subprocess
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
+
+from aiohttp import ClientSession, ClientError, TCPConnector, ClientTimeout
+
+from fm_url_checker.producer.standin_broker import StandInBroker
+
+log = logging.getLogger(__name__)
+
+PERCENTILES = (50, 75, 90, 95, 99, 99.9, 99.99, 100)
+
+
+class LatencyHistogram:
+    """
+    HDR style histogram, values are kept in log linear buckets with `significant_digits` of precision over any range,
+    so memory doesn't grow with the number of samples.
+    """
+
+    def __init__(self, significant_digits: int = 2, unit: float = 1e-6):
+        self._sub_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self._sub_count = 1 << self._sub_bits
+        self._unit = unit
+        self._counts: Counter = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min: float = None
+        self.max: float = None
+
+    def _index(self, value: int) -> int:
+        if value < self._sub_count:
+            return value
+        exponent = value.bit_length() - self._sub_bits
+        return (exponent << self._sub_bits) + (value >> exponent)
+
+    def _highest_equivalent(self, index: int) -> int:
+        exponent, sub_bucket = divmod(index, self._sub_count)
+        return ((sub_bucket + 1) << exponent) - 1 if exponent else sub_bucket
+
+    def record(self, seconds: float) -> None:
+        self._counts[self._index(max(0, int(seconds / self._unit)))] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percentile: float) -> float:
+        if not self.count:
+            return 0.0
+        if percentile >= 100:
+            return self.max
+        threshold = max(1, math.ceil(self.count * percentile / 100))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= threshold:
+                return min(self._highest_equivalent(index) * self._unit, self.max)
+        return self.max
+
+    def render(self) -> str:
+        lines = [f"{'percentile':>10} {'latency_ms':>11}"]
+        for percentile in PERCENTILES:
+            lines.append(f"{percentile:>10} {self.percentile(percentile) * 1000:>11.2f}")
+        lines.append(f"{'mean':>10} {self.mean * 1000:>11.2f}")
+        return "\n".join(lines)
+
+
+@dataclass
+class Report:
+    histogram: LatencyHistogram = field(default_factory=LatencyHistogram)
+    statuses: Counter = field(default_factory=Counter)
+    errors: Counter = field(default_factory=Counter)
+    elapsed: float = 0.0
+
+    @property
+    def completed(self) -> int:
+        return self.histogram.count
+
+    @property
+    def throughput(self) -> float:
+        return self.completed / self.elapsed if self.elapsed else 0.0
+
+    def render(self) -> str:
+        lines = [f"requests: {self.completed} in {self.elapsed:.2f}s, throughput: {self.throughput:.1f} req/s",
+                 "statuses: " + ", ".join(f"{status}: {count}" for status, count in sorted(self.statuses.items())),
+                 self.histogram.render()]
+        if self.errors:
+            lines.append("errors:")
+            lines.extend(f"  {error}: {count}" for error, count in self.errors.most_common())
+        return "\n".join(lines)
+
+
+def read_urls(path: str = None) -> Iterator[str]:
+    """ Cycles through the URLs in a file, or generates synthetic ones """
+
+    if path is None:
+        return (f"http://site{i % 1000}.example.com/page/{i}" for i in itertools.count())
+
+    with open(path, encoding="utf8") as url_file:
+        urls = [line.strip() for line in url_file if line.strip()]
+    if not urls:
+        raise ValueError(f"No URLs in {path}")
+    return itertools.cycle(urls)
+
+
+async def _send(session: ClientSession, target: str, url: str, report: Report, started: float) -> None:
+    """ Sends a single request, latency is measured from `started` so queueing in the generator is included """
+
+    try:
+        async with session.post(f"{target}/check", json={"url": url}) as response:
+            body = await response.read()
+            status = response.status
+    except (ClientError, asyncio.TimeoutError, OSError) as e:
+        report.histogram.record(time.perf_counter() - started)
+        report.statuses["error"] += 1
+        report.errors[e.__class__.__name__] += 1
+        return
+
+    report.histogram.record(time.perf_counter() - started)
+    report.statuses[status] += 1
+    if status >= 400:
+        try:
+            problem_type = json.loads(body).get("type") or f"http {status}"
+        except (ValueError, AttributeError):
+            problem_type = f"http {status}"
+        report.errors[problem_type] += 1
+
+
+async def run_load(target: str,
+                   urls: Iterator[str],
+                   rate: float = None,
+                   concurrency: int = 16,
+                   duration: float = None,
+                   requests: int = None,
+                   timeout: float = 10) -> Report:
+    """
+    Closed loop with `concurrency` workers when no rate is given, otherwise open loop at `rate` requests per second
+    with at most `concurrency` of them outstanding. Stops after `duration` seconds or `requests` requests.
+    """
+
+    if duration is None and requests is None:
+        raise ValueError("Expecting a duration or a number of requests")
+
+    report = Report()
+    target = target.rstrip("/")
+    deadline = time.perf_counter() + duration if duration else math.inf
+    counter = itertools.count() if requests is None else iter(range(requests))
+
+    async with ClientSession(connector=TCPConnector(limit=concurrency),
+                             timeout=ClientTimeout(total=timeout)) as session:
+        started = time.perf_counter()
+        if rate is None:
+            async def worker():
+                for _ in counter:
+                    if time.perf_counter() >= deadline:
+                        return
+                    await _send(session, target, next(urls), report, time.perf_counter())
+
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+        else:
+            semaphore = asyncio.Semaphore(concurrency)
+            pending = set()
+
+            async def send(url: str, scheduled: float):
+                try:
+                    await _send(session, target, url, report, scheduled)
+                finally:
+                    semaphore.release()
+
+            for i in counter:
+                # intended send time, a stalled target shows up as latency instead of a lower request rate
+                scheduled = started + i / rate
+                if scheduled >= deadline:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await semaphore.acquire()
+                task = asyncio.ensure_future(send(next(urls), scheduled))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+
+        report.elapsed = time.perf_counter() - started
+    return report
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_for_producer(target: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Producer exited with code {process.returncode}")
+            try:
+                async with session.get(f"{target}/health/live") as response:
+                    if response.status == 200:
+                        return
+            except ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Producer not live after {timeout}s")
+
+
+async def run_local(producer_cmd: str, **kwargs) -> Report:
+    """ Starts a stand-in broker and a producer process against it, then runs the load """
+
+    broker = StandInBroker()
+    await broker.start()
+    port = _free_port()
+    env = dict(os.environ,
+               RABBITMQ_HOST="127.0.0.1",
+               RABBITMQ_PORT=str(broker.port),
+               SERVICE_PORT=str(port))
+    process = subprocess.Popen(shlex.split(producer_cmd.format(port=port)), env=env)
+    target = f"http://127.0.0.1:{port}"
+    try:
+        await _wait_for_producer(target, process)
+        report = await run_load(target, **kwargs)
+    finally:
+        process.terminate()
+        process.wait()
+        await broker.stop()
+    print(f"broker: {broker.messages} messages over {broker.connections} connections")
+    return report
+
+
+def main(argv: List[str] = None) -> Optional[Report]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="http://localhost:8080", help="producer base url")
+    parser.add_argument("--urls", help="file with one url per line, synthetic urls are used if not given")
+    parser.add_argument("--rate", type=float, help="requests per second, max concurrency if not given")
+    parser.add_argument("--concurrency", type=int, default=16, help="max outstanding requests")
+    parser.add_argument("--duration", type=float, help="seconds to run for")
+    parser.add_argument("--requests", type=int, help="number of requests to send")
+    parser.add_argument("--timeout", type=float, default=10, help="per request timeout in seconds")
+    parser.add_argument("--local", action="store_true",
+                        help="start a stand-in broker and the producer against it instead of using --target")
+    # uwsgi as deployed rather than the single threaded dev server, the port is passed in SERVICE_PORT
+    parser.add_argument("--producer-cmd",
+                        default=f"uwsgi --ini fm_url_checker/producer/conf.ini --chdir {shlex.quote(os.getcwd())}",
+                        help="command used to start the producer with --local, {port} is replaced with its port")
+    args = parser.parse_args(argv)
+    if args.duration is None and args.requests is None:
+        parser.error("one of --duration or --requests is required")
+
+    kwargs = dict(urls=read_urls(args.urls),
+                  rate=args.rate,
+                  concurrency=args.concurrency,
+                  duration=args.duration,
+                  requests=args.requests,
+                  timeout=args.timeout)
+    loop = asyncio.get_event_loop()
+    if args.local:
+        report = loop.run_until_complete(run_local(args.producer_cmd, **kwargs))
+    else:
+        report = loop.run_until_complete(run_load(args.target, **kwargs))
+    print(report.render())
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,24 @@ RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "rabbitmq")
 RABBITMQ_VHOST = os.getenv("RABBITMQ_VHOST", "/")
 RABBITMQ_JOB_EXCHANGE = os.getenv("RABBITMQ_JOB_EXCHANGE", "")
 RABBITMQ_JOB_ROUTING_KEY = os.getenv("RABBITMQ_JOB_ROUTING_KEY", "jobs")
+RABBITMQ_MONITOR_QUEUE = os.getenv("RABBITMQ_MONITOR_QUEUE", "monitors")
+RABBITMQ_STARTUP_TIMEOUT = float(os.getenv("RABBITMQ_STARTUP_TIMEOUT", "60"))
+RABBITMQ_PROBE_MAX_DELAY = float(os.getenv("RABBITMQ_PROBE_MAX_DELAY", "5"))
+
+# amqp publishes to RabbitMQ, embedded runs the consumer inside the producer process, see transport.EmbeddedTransport
+TRANSPORT = os.getenv("TRANSPORT", "amqp").lower()
+# Journal directory of the embedded queues, kept in memory only when empty
+EMBEDDED_JOURNAL_DIR = os.getenv("EMBEDDED_JOURNAL_DIR", "")
+
+MONITOR_MIN_INTERVAL = int(os.getenv("MONITOR_MIN_INTERVAL", "60"))
+MONITOR_MAX_INTERVAL = int(os.getenv("MONITOR_MAX_INTERVAL", str(30 * 24 * 3600)))
+
+# Duplicate submission window in seconds, disabled when 0
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "0"))
+# Expected number of distinct URLs per window, the filter memory is sized from this
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", "1000000"))
+DEDUP_ERROR_RATE = float(os.getenv("DEDUP_ERROR_RATE", "0.001"))
+DEDUP_BUCKETS = int(os.getenv("DEDUP_BUCKETS", "4"))
 
 if DEBUG:
     logging.getLogger("").setLevel("DEBUG")
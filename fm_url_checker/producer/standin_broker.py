@@ -0,0 +1,155 @@
+"""
+Minimal AMQP 0-9-1 server that accepts connections, channels and publishes (with publisher confirms) and counts the
+messages, nothing is routed or stored. It lets the producer be load tested without a RabbitMQ server, so the numbers
+reflect the producer itself, AMQP connection setup included.
+
+    python fm_url_checker/producer/standin_broker.py --port 5673
+"""
+import argparse
+import asyncio
+import logging
+from asyncio import StreamReader, StreamWriter
+from typing import Callable, Dict, Optional
+
+from pika import frame, spec
+
+log = logging.getLogger(__name__)
+
+FRAME_MAX = 131072
+SERVER_PROPERTIES = {"product": "stand-in",
+                     "capabilities": {"publisher_confirms": True, "basic.nack": True}}
+
+
+class _Channel:
+    def __init__(self):
+        self.confirms = False
+        self.delivery_tag = 0
+        self.routing_key: str = None
+        self.body_size = 0
+        self.body = bytearray()
+
+
+class StandInBroker:
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 on_message: Callable[[str, Optional[spec.BasicProperties], bytes], None] = None):
+        self._host = host
+        self._port = port
+        self._on_message = on_message
+        self._server: asyncio.AbstractServer = None
+        self.connections = 0
+        self.messages = 0
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, host=self._host, port=self._port)
+        log.info(f"Stand-in broker listening on {self._host}:{self.port}")
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    @staticmethod
+    def _send(writer: StreamWriter, channel: int, method) -> None:
+        writer.write(frame.Method(channel, method).marshal())
+
+    async def _handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        self.connections += 1
+        channels: Dict[int, _Channel] = {}
+        properties: Dict[int, spec.BasicProperties] = {}
+        buffer = b""
+        try:
+            while True:
+                data = await reader.read(FRAME_MAX)
+                if not data:
+                    return
+                buffer += data
+                while buffer:
+                    consumed, value = frame.decode_frame(buffer)
+                    if not consumed:
+                        break
+                    buffer = buffer[consumed:]
+
+                    if isinstance(value, frame.ProtocolHeader):
+                        self._send(writer, 0, spec.Connection.Start(server_properties=SERVER_PROPERTIES))
+                    elif isinstance(value, frame.Method):
+                        if self._on_method(writer, value.channel_number, value.method, channels):
+                            await writer.drain()
+                            return
+                    elif isinstance(value, frame.Header):
+                        properties[value.channel_number] = value.properties
+                        channels[value.channel_number].body_size = value.body_size
+                        if not value.body_size:
+                            self._published(writer, value.channel_number, channels, properties)
+                    elif isinstance(value, frame.Body):
+                        channel = channels[value.channel_number]
+                        channel.body.extend(value.fragment)
+                        if len(channel.body) >= channel.body_size:
+                            self._published(writer, value.channel_number, channels, properties)
+                await writer.drain()
+        except (ConnectionError, KeyError) as e:
+            log.warning(f"Stand-in broker dropping connection: {e.__class__.__name__}: {e}")
+        finally:
+            writer.close()
+
+    def _published(self, writer: StreamWriter, number: int, channels: Dict[int, _Channel],
+                   properties: Dict[int, spec.BasicProperties]) -> None:
+        channel = channels[number]
+        self.messages += 1
+        if self._on_message:
+            self._on_message(channel.routing_key, properties.pop(number, None), bytes(channel.body))
+        channel.body = bytearray()
+        channel.body_size = 0
+        if channel.confirms:
+            channel.delivery_tag += 1
+            self._send(writer, number, spec.Basic.Ack(delivery_tag=channel.delivery_tag))
+
+    def _on_method(self, writer: StreamWriter, number: int, method, channels: Dict[int, _Channel]) -> bool:
+        """ Answers a single method frame, returns True once the connection is closed """
+
+        if isinstance(method, spec.Connection.StartOk):
+            self._send(writer, 0, spec.Connection.Tune(channel_max=2047, frame_max=FRAME_MAX, heartbeat=0))
+        elif isinstance(method, spec.Connection.Open):
+            self._send(writer, 0, spec.Connection.OpenOk())
+        elif isinstance(method, spec.Connection.Close):
+            self._send(writer, 0, spec.Connection.CloseOk())
+            return True
+        elif isinstance(method, spec.Channel.Open):
+            channels[number] = _Channel()
+            self._send(writer, number, spec.Channel.OpenOk())
+        elif isinstance(method, spec.Channel.Close):
+            channels.pop(number, None)
+            self._send(writer, number, spec.Channel.CloseOk())
+        elif isinstance(method, spec.Confirm.Select):
+            channels[number].confirms = True
+            if not method.nowait:
+                self._send(writer, number, spec.Confirm.SelectOk())
+        elif isinstance(method, spec.Basic.Qos):
+            self._send(writer, number, spec.Basic.QosOk())
+        elif isinstance(method, spec.Queue.Declare):
+            self._send(writer, number, spec.Queue.DeclareOk(queue=method.queue, message_count=0, consumer_count=0))
+        elif isinstance(method, spec.Exchange.Declare):
+            self._send(writer, number, spec.Exchange.DeclareOk())
+        elif isinstance(method, spec.Basic.Publish):
+            channels[number].routing_key = method.routing_key
+        return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5673)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="INFO")
+    broker = StandInBroker(host=args.host, port=args.port)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(broker.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        log.info(f"Received {broker.messages} messages over {broker.connections} connections")
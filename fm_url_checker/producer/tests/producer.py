@@ -1,12 +1,20 @@
+import asyncio
+import csv
+import gzip
 import json
+import socket
+import threading
+from contextlib import contextmanager
 from uuid import uuid4
 
 import pytest
 import re
+from aiohttp import web
 from flexmock import flexmock
 from pika import BasicProperties
 
-from fm_url_checker.producer import api as producer_api, settings
+from fm_url_checker.producer import api as producer_api, settings, broker, dedup, loadgen, bulk, transport
+from fm_url_checker.producer.standin_broker import StandInBroker
 
 UUID_REX = re.compile(r"[0-9a-f]{32}")
 
@@ -83,7 +91,7 @@ class TestJobQueueing:
         fake_channel = FakePikaChannel()
         fake_connection = FakePikaConnection(channel_instance=fake_channel)
 
-        (flexmock(producer_api)
+        (flexmock(transport)
          .should_receive("BlockingConnection")
          .and_return(fake_connection))
 
@@ -144,3 +152,332 @@ class TestAPI:
 
         assert not {"title", "type", "status"}.difference(set(response.keys())), "response is missing required keys"
         assert response.get("status") == status == 400, "response didn't return correct status"
+
+    def test_ready(self):
+        (flexmock(broker)
+         .should_receive("probe_broker")
+         .and_return(True)
+         .and_return(False)
+         .one_by_one())
+
+        assert producer_api.ready()[1] == 200, "not ready with a reachable broker"
+        assert producer_api.ready()[1] == 503, "ready with an unreachable broker"
+
+    def test_monitor(self):
+        url = "https://google.com"
+
+        (flexmock(producer_api)
+         .should_receive("_push_monitor")
+         .with_args("register", url, 300)
+         .once())
+
+        response, status = producer_api.post_monitor({"url": url, "interval": 300})
+        assert status == 202, "bad response status"
+        assert response == {"url": url, "interval": 300}, "bad response"
+
+        response, status = producer_api.post_monitor({"url": url, "interval": 1})
+        assert response.get("status") == status == 400, "interval not validated"
+
+        response, status = producer_api.post_monitor({"url": "bad://google.com", "interval": 300})
+        assert response.get("status") == status == 400, "url not validated"
+
+    def test_dedup(self):
+        url = "https://google.com"
+        job_id = uuid4().hex
+
+        (flexmock(producer_api)
+         .should_receive("_push_job")
+         .with_args(url, job_id=str)
+         .replace_with(lambda url, job_id=None: job_id)
+         .once())
+        flexmock(producer_api, _dedup_filter=dedup.DedupFilter(window=60, capacity=1000))
+
+        response, status = producer_api.post({"url": url})
+        assert status == 201, "first submission not queued"
+
+        duplicate, status = producer_api.post({"url": url})
+        assert status == 200, "duplicate queued"
+        assert UUID_REX.match(duplicate.get("id")), "duplicate didn't return a job id"
+        assert duplicate["id"] == response["id"], "duplicate not aliased to the queued job"
+
+    def test_dedup_failed_publish(self):
+        url = "https://google.com"
+        calls = []
+
+        def push_job(url, job_id=None):
+            calls.append(job_id)
+            if len(calls) == 1:
+                raise ConnectionError("Broker unreachable")
+            return job_id
+
+        flexmock(producer_api).should_receive("_push_job").replace_with(push_job)
+        flexmock(producer_api, _dedup_filter=dedup.DedupFilter(window=60, capacity=1000))
+
+        with pytest.raises(ConnectionError):
+            producer_api.post({"url": url})
+        response, status = producer_api.post({"url": url})
+        assert status == 201 and len(calls) == 2, "retry of a failed publish treated as duplicate"
+
+
+@pytest.mark.producer
+class TestDedup:
+    def test_normalize(self):
+        assert dedup.normalize_url("HTTP://Google.com:80") == "http://google.com/"
+        assert dedup.normalize_url("https://google.com:443/a?b=c#frag") == "https://google.com/a?b=c"
+        assert dedup.normalize_url("https://google.com:8443/a") == "https://google.com:8443/a"
+
+    def test_window(self):
+        now = [0.0]
+        dedup_filter = dedup.DedupFilter(window=60, capacity=1000, buckets=4, clock=lambda: now[0])
+
+        job_id, duplicate = dedup_filter.check("http://google.com")
+        assert not duplicate, "first submission flagged as duplicate"
+        assert dedup_filter.check("http://google.com") == (job_id, False), "lookup recorded the url"
+        dedup_filter.add("http://google.com")
+
+        now[0] = 30
+        alias, duplicate = dedup_filter.check("HTTP://google.com/")
+        assert duplicate, "duplicate not detected"
+        assert alias == job_id, "duplicate didn't get the original job id"
+
+        assert not dedup_filter.check("http://google.com/other")[1], "different url flagged as duplicate"
+
+        now[0] = 61
+        new_id, duplicate = dedup_filter.check("http://google.com")
+        assert not duplicate, "duplicate detected outside the window"
+        assert new_id != job_id, "job id reused outside the window"
+
+    def test_salted_per_filter(self):
+        # as in two uwsgi processes, each with its own filter
+        first, second = (dedup.DedupFilter(window=60, capacity=1000, clock=lambda: 0) for _ in range(2))
+        assert first.check("http://google.com")[0] != second.check("http://google.com")[0], "job ids collide"
+
+    def test_false_positive_rate(self):
+        now = [0.0]
+        dedup_filter = dedup.DedupFilter(window=60, capacity=40000, error_rate=0.01, buckets=4, clock=lambda: now[0])
+        # every bucket of the window filled to its share of the capacity
+        for bucket in range(4):
+            now[0] = bucket * 15
+            for i in range(10000):
+                dedup_filter.add(f"http://google.com/{bucket}/{i}")
+        false_positives = sum(dedup_filter.check(f"http://other.com/{i}")[1] for i in range(20000))
+        assert false_positives < 300, "false positive rate over the window above the configured one"
+
+
+@pytest.mark.producer
+class TestStandInBroker:
+    def test_push_job(self):
+        messages = []
+        standin = StandInBroker(on_message=lambda routing_key, properties, body: messages.append(
+            (routing_key, properties.headers, json.loads(body))))
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(standin.start())
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        flexmock(settings, RABBITMQ_HOST="127.0.0.1", RABBITMQ_PORT=standin.port)
+        try:
+            job_ids = [producer_api._push_job("https://google.com") for _ in range(3)]
+        finally:
+            asyncio.run_coroutine_threadsafe(standin.stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+        assert standin.connections == 3 and standin.messages == 3, "messages not received"
+        assert messages[0] == (settings.RABBITMQ_JOB_ROUTING_KEY,
+                               {"job_id": job_ids[0]},
+                               {"url": "https://google.com"}), "malformed message"
+
+
+@pytest.mark.producer
+class TestLatencyHistogram:
+    def test_percentiles(self):
+        histogram = loadgen.LatencyHistogram(significant_digits=2)
+        for millis in range(1, 1001):
+            histogram.record(millis / 1000)
+
+        assert histogram.count == 1000
+        assert histogram.percentile(50) == pytest.approx(0.5, rel=0.01)
+        assert histogram.percentile(99) == pytest.approx(0.99, rel=0.01)
+        assert histogram.percentile(100) == histogram.max == 1.0
+        assert histogram.mean == pytest.approx(0.5005)
+        assert "99.9" in histogram.render()
+
+
+@pytest.mark.producer
+@pytest.mark.asyncio
+class TestLoadGenerator:
+    @staticmethod
+    async def fake_producer():
+        async def check(request):
+            body = await request.json()
+            if body["url"].startswith("bad"):
+                return web.json_response({"type": "fm/error/validation", "title": "Invalid URL provided",
+                                          "status": 400}, status=400)
+            return web.json_response({"id": uuid4().hex}, status=201)
+
+        app = web.Application()
+        app.router.add_post("/check", check)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host="127.0.0.1", port=0).start()
+        return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+    async def test_concurrency(self, tmp_path):
+        url_file = tmp_path / "urls.txt"
+        url_file.write_text("https://google.com\nbad://google.com\n")
+        runner, target = await self.fake_producer()
+        try:
+            report = await loadgen.run_load(target, loadgen.read_urls(str(url_file)), concurrency=4, requests=100)
+        finally:
+            await runner.cleanup()
+
+        assert report.completed == 100 and report.throughput > 0, "requests not sent"
+        assert report.statuses == {201: 50, 400: 50}, "wrong status breakdown"
+        assert report.errors == {"fm/error/validation": 50}, "errors not grouped by problem type"
+        assert "throughput" in report.render()
+
+    async def test_rate(self):
+        runner, target = await self.fake_producer()
+        try:
+            report = await loadgen.run_load(target, loadgen.read_urls(), rate=200, concurrency=8, duration=0.5)
+        finally:
+            await runner.cleanup()
+
+        assert 90 <= report.completed <= 101, "rate not respected"
+        assert report.statuses == {201: report.completed}, "synthetic urls rejected"
+
+    async def test_connection_errors(self):
+        report = await loadgen.run_load("http://127.0.0.1:1", loadgen.read_urls(), concurrency=2, requests=4)
+        assert report.statuses == {"error": 4} and sum(report.errors.values()) == 4, "connection errors not reported"
+
+
+@contextmanager
+def standin_broker(messages: list):
+    standin = StandInBroker(on_message=lambda routing_key, properties, body: messages.append(
+        (properties.headers["job_id"], json.loads(body)["url"])))
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(standin.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield standin
+    finally:
+        asyncio.run_coroutine_threadsafe(standin.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+@pytest.mark.producer
+class TestBulkEnqueue:
+    def test_read_urls(self, tmp_path):
+        path = tmp_path / "urls.csv.gz"
+        with gzip.open(path, "wt") as url_file:
+            url_file.write('id,url\n1,https://google.com\n2,"https://example.com/a,b"\n\n3,\n')
+
+        urls = list(bulk.read_urls(str(path), csv_format=bulk.is_csv(str(path)), column="url"))
+        assert [url for offset, url in urls] == ["https://google.com", "https://example.com/a,b"]
+        resumed = list(bulk.read_urls(str(path), csv_format=True, column="url", offset=urls[0][0]))
+        assert resumed == urls[1:], "not resumed from the offset"
+
+        by_index = list(bulk.read_urls(str(path), csv_format=True, column="1"))
+        assert by_index == urls, "header row read as a url"
+
+        path = tmp_path / "urls.csv"
+        path.write_text("https://google.com,1\nhttps://example.com,2\n")
+        urls = list(bulk.read_urls(str(path), csv_format=True, header=False))
+        assert [url for offset, url in urls] == ["https://google.com", "https://example.com"], "first row skipped"
+        with pytest.raises(ValueError):
+            list(bulk.read_urls(str(path), csv_format=True, column="url", header=False))
+
+    def test_enqueue_and_resume(self, tmp_path):
+        path = tmp_path / "urls.txt"
+        path.write_text("".join(f"https://site{i}.com/\n" for i in range(50)) + "ftp://google.com\n")
+        manifest = tmp_path / "urls.manifest"
+        flexmock(settings, RABBITMQ_HOST="127.0.0.1")
+
+        messages = []
+        with standin_broker(messages) as standin:
+            flexmock(settings, RABBITMQ_PORT=standin.port)
+            publisher = bulk.enqueue(str(path), str(manifest), processes=2, batch_size=8, window=4,
+                                     checkpoint_every=10)
+            assert publisher.published == 50 and publisher.rejected == 1
+
+            # a crash after writing to the manifest but before the next checkpoint
+            with open(manifest, "a") as manifest_file:
+                manifest_file.write("partial row")
+            with open(path, "a") as url_file:
+                url_file.write("https://appended.com/\n")
+            resumed = bulk.enqueue(str(path), str(manifest), processes=0, window=4)
+
+        assert resumed.published == 1 and resumed.rejected == 0, "not resumed from the checkpoint"
+        with open(manifest, newline="") as manifest_file:
+            rows = list(csv.reader(manifest_file))
+        assert len(rows) == 52, "manifest not truncated to the checkpoint"
+        assert [url for job_id, url, error in rows[:3]] == ["https://site0.com/", "https://site1.com/",
+                                                             "https://site2.com/"], "manifest out of input order"
+        assert rows[50][0] == "" and rows[50][1] == "ftp://google.com" and rows[50][2], "rejection not recorded"
+        assert sorted(messages) == sorted((job_id, url) for job_id, url, error in rows if job_id), \
+            "manifest does not match the published jobs"
+
+
+@pytest.mark.producer
+class TestEmbeddedTransport:
+    def test_post(self, tmp_path):
+        from fm_url_checker.consumer import url_check, settings as consumer_settings
+        from fm_url_checker.consumer.models import JobResult
+        from fm_url_checker.scheduler import settings as scheduler_settings
+
+        received = []
+        done = threading.Event()
+
+        async def process_job(job):
+            received.append(job)
+            done.set()
+            return JobResult(job=job, status=200)
+
+        flexmock(url_check).should_receive("_process_job").replace_with(process_job)
+        # a consumer health server would fail the start, its port is taken
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        flexmock(consumer_settings, HEALTH_PORT=listener.getsockname()[1])
+        flexmock(scheduler_settings, SCHEDULER_STORE_PATH=str(tmp_path / "monitors.journal"))
+        embedded = transport.EmbeddedTransport(journal_dir=str(tmp_path))
+        flexmock(producer_api, _transport=embedded, _dedup_filter=dedup.DedupFilter(window=60, capacity=1000))
+        try:
+            assert producer_api.ready()[1] == 200, "embedded consumer not ready"
+            response, status = producer_api.post({"url": "https://google.com"})
+            assert status == 201
+            assert done.wait(5), "job not consumed"
+        finally:
+            embedded.stop()
+            listener.close()
+
+        assert received[0].id == response["id"] and received[0].url == "https://google.com", "wrong job consumed"
+        assert (tmp_path / f"{settings.RABBITMQ_JOB_ROUTING_KEY}.journal").exists(), "job queue not journaled"
+
+    def test_failed_start(self, tmp_path):
+        from fm_url_checker.consumer import run as consumer_run
+
+        (flexmock(consumer_run)
+         .should_receive("startup")
+         .and_raise(OSError("Address already in use"))
+         .once())
+        threads = threading.active_count()
+        embedded = transport.EmbeddedTransport(journal_dir=str(tmp_path))
+        flexmock(producer_api, _transport=embedded)
+
+        for _ in range(3):
+            assert producer_api.ready()[1] == 503, "failed start reported ready"
+        with pytest.raises(OSError):
+            embedded.publish("jobs", {"url": "https://google.com"}, {})
+        assert threading.active_count() == threads, "event loop thread leaked"
+
+    def test_single_process(self, tmp_path):
+        flexmock(transport).should_receive("_process_count").and_return(2)
+        embedded = transport.EmbeddedTransport(journal_dir=str(tmp_path))
+        with pytest.raises(RuntimeError):
+            embedded.publish("jobs", {"url": "https://google.com"}, {})
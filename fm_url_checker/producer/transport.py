@@ -0,0 +1,163 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+from asyncio import AbstractEventLoop
+from typing import Callable, Coroutine, Dict
+
+import uvloop
+from pika import BlockingConnection, ConnectionParameters, PlainCredentials, BasicProperties
+from pika.channel import Channel
+
+from fm_url_checker.producer import settings, broker
+
+log = logging.getLogger(__name__)
+
+
+def connection_parameters() -> ConnectionParameters:
+    return ConnectionParameters(host=settings.RABBITMQ_HOST,
+                                port=settings.RABBITMQ_PORT,
+                                virtual_host=settings.RABBITMQ_VHOST,
+                                credentials=PlainCredentials(username=settings.RABBITMQ_USER,
+                                                             password=settings.RABBITMQ_PASS))
+
+
+class AmqpTransport:
+    """ Publishes to RabbitMQ, the consumer and the scheduler run as services of their own """
+
+    def publish(self, routing_key: str, body: Dict, headers: Dict[str, str]) -> None:
+        connection = BlockingConnection(connection_parameters())
+        channel: Channel = connection.channel()
+        channel.basic_publish(exchange=settings.RABBITMQ_JOB_EXCHANGE,
+                              routing_key=routing_key,
+                              body=json.dumps(body),
+                              properties=BasicProperties(content_type="application/json",
+                                                         content_encoding="utf8",
+                                                         headers=headers))
+        connection.close()
+
+    def ready(self) -> bool:
+        return broker.probe_broker(timeout=0.5)
+
+
+def _process_count() -> int:
+    try:
+        import uwsgi
+    except ImportError:
+        return 1
+    return uwsgi.numproc
+
+
+class EmbeddedTransport:
+    """
+    Runs the consumer and the monitor scheduler on an event loop thread inside the producer process, on an
+    EmbeddedWorker, and publishes straight to its queues. Started on first use, after uwsgi forked its worker. The
+    queues, journals and scheduler store belong to that one process, so uwsgi has to run a single one. A failed start
+    is not retried, every later call raises the same error.
+    """
+
+    def __init__(self, journal_dir: str = None, timeout: float = 5):
+        self._journal_dir = journal_dir
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._pid: int = None
+        self._loop: AbstractEventLoop = None
+        self._worker = None
+        self._shutdown: Callable[[], Coroutine] = None
+        self._error: Exception = None
+
+    @staticmethod
+    def _run_loop(loop: AbstractEventLoop) -> None:
+        # the consumer's module level tasks resolve their loop lazily, on this thread
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._error is not None:
+                raise self._error
+            try:
+                self._start_consumer()
+            except Exception as e:
+                self._error = e
+                raise
+
+    def _start_consumer(self) -> None:
+        if _process_count() > 1:
+            raise RuntimeError(f"The embedded transport needs a single uwsgi process, running {_process_count()}")
+
+        # imported here, the consumer isn't loaded with the AMQP transport
+        from fm_url_checker.consumer import run as consumer_run, concurrency
+        from fm_url_checker.consumer.amqp.models import QueueInfo
+        from fm_url_checker.consumer.embedded.worker import EmbeddedWorker
+        from fm_url_checker.scheduler import run as scheduler_run, settings as scheduler_settings
+
+        log.info("Starting embedded consumer")
+        loop = uvloop.new_event_loop()
+        thread = threading.Thread(target=self._run_loop, args=(loop,), name="embedded-consumer", daemon=True)
+        worker = EmbeddedWorker(prefetch_count=concurrency.controller.limit,
+                                journal_dir=self._journal_dir,
+                                loop=loop)
+        scheduler = scheduler_run.create_scheduler(worker, loop)
+
+        async def startup():
+            # readiness is reported by the producer, the consumer health server would need a port per process
+            await consumer_run.startup(worker, health_server=False)
+            await scheduler.start()
+            await worker.register_queue(QueueInfo(name=scheduler_settings.RABBITMQ_MONITOR_QUEUE),
+                                        scheduler.received_message)
+
+        async def shutdown():
+            await asyncio.gather(worker.stop(), scheduler.stop(), concurrency.controller.stop())
+
+        thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(startup(), loop).result(self._timeout)
+        except Exception:
+            # nothing is left running behind the failed start
+            try:
+                asyncio.run_coroutine_threadsafe(shutdown(), loop).result(self._timeout)
+            except Exception as e:
+                log.warning(f"Embedded consumer shutdown after a failed start failed: {e.__class__.__name__}: {e}")
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(self._timeout)
+            if not thread.is_alive():
+                loop.close()
+            raise
+        self._loop, self._worker, self._shutdown, self._pid = loop, worker, shutdown, os.getpid()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(self._timeout)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._pid = None
+
+    def publish(self, routing_key: str, body: Dict, headers: Dict[str, str]) -> None:
+        self._start()
+        asyncio.run_coroutine_threadsafe(self._worker.publish(routing_key=routing_key,
+                                                              body=json.dumps(body).encode("utf8"),
+                                                              headers=headers),
+                                         self._loop).result(self._timeout)
+
+    def ready(self) -> bool:
+        try:
+            self._start()
+        except Exception as e:
+            log.error(f"Embedded consumer failed to start: {e.__class__.__name__}: {e}")
+            return False
+        return self._worker.ready
+
+
+def from_settings():
+    if settings.TRANSPORT == "amqp":
+        return AmqpTransport()
+    if settings.TRANSPORT == "embedded":
+        return EmbeddedTransport(journal_dir=settings.EMBEDDED_JOURNAL_DIR or None)
+    raise ValueError(f"Unknown transport {settings.TRANSPORT}, expecting amqp or embedded")
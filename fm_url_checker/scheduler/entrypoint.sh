@@ -0,0 +1,3 @@
+#!/bin/sh
+
+exec python fm_url_checker/scheduler/run.py
\ No newline at end of file
@@ -0,0 +1,40 @@
+import logging.config
+
+from pythonjsonlogger.jsonlogger import JsonFormatter
+
+logging.config.dictConfig({
+    'version': 1,
+    'formatters': {
+        'standard': {
+            'format': '[%(process)d] %(asctime)s [%(levelname)s] %(name)s: %(message)s',
+        },
+        'json_formatter': {
+            '()': JsonFormatter,
+            'fmt': '%(process)d %(asctime)s %(levelname)s %(name) %(message)s',
+        },
+    },
+    'handlers': {
+        'default': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'standard',
+            'level': 'DEBUG',
+        },
+        'json_handler': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json_formatter',
+            'level': 'DEBUG',
+        },
+    },
+    'loggers': {
+        '': {
+            'handlers': ['json_handler'],
+            'level': 'DEBUG',
+            'propagate': True,
+        },
+        'aio_pika': {
+            'handlers': ['json_handler'],
+            'level': 'WARNING',
+            'propagate': True,
+        },
+    }
+})
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import logging
+import random
+from array import array
+from asyncio import AbstractEventLoop, Task
+from json import JSONDecodeError
+from typing import Callable, Coroutine, Dict, List, Optional
+
+from aio_pika import IncomingMessage
+
+from fm_url_checker.consumer.amqp.worker import BaseTask
+from fm_url_checker.scheduler.store import MonitorStore
+from fm_url_checker.scheduler.timer_wheel import TimerWheel
+
+log = logging.getLogger(__name__)
+
+_INDEX_BITS = 32
+_INDEX_MASK = (1 << _INDEX_BITS) - 1
+
+
+class MonitorScheduler(BaseTask):
+    """
+    Re-queues registered URLs on their interval.
+
+    Registrations live in flat arrays indexed by a slot number, the timer wheel only holds the slot number packed with
+    a generation counter so unregistered (or re-registered) monitors are dropped lazily when their timer fires.
+    New and restored registrations start at a random phase of their interval and every reschedule is jittered, which
+    spreads the checks evenly instead of firing them in bursts.
+
+    The tick loop only hands due checks to a backlog drained by `publishers` tasks, so a slow publish (e.g. during a
+    broker reconnect) doesn't stall the wheel and release everything that came due meanwhile at once. A check that
+    finds the backlog full (`backlog` checks) is skipped, the monitor comes round again on its next interval.
+    """
+
+    def __init__(self,
+                 publish: Callable[[str], Coroutine],
+                 store: MonitorStore = None,
+                 tick: float = 1,
+                 jitter: float = 0.05,
+                 publishers: int = 8,
+                 backlog: int = 10000,
+                 loop: AbstractEventLoop = None):
+        self._publish = publish
+        self._store = store
+        self._tick = tick
+        self._jitter = jitter
+        self._wheel: TimerWheel = None
+        self._publisher_count = max(1, publishers)
+        self._backlog_size = backlog
+        # created in start(), on the scheduler's loop
+        self._backlog: asyncio.Queue = None
+        self._publishers: List[Task] = []
+        self.skipped = 0
+        self._started_at: float = None
+
+        self._slots: Dict[str, int] = {}
+        self._urls: List[Optional[str]] = []
+        self._intervals = array("L")
+        self._generations = array("L")
+        self._free: List[int] = []
+        super().__init__(loop=loop)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _now(self) -> int:
+        return int((self._loop.time() - self._started_at) / self._tick)
+
+    def _schedule(self, slot: int, delay: float) -> None:
+        due = self._wheel.current + max(1, round(delay / self._tick))
+        self._wheel.add(due, self._generations[slot] << _INDEX_BITS | slot)
+
+    def _add(self, url: str, interval: int) -> None:
+        slot = self._slots.get(url)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self._urls[slot] = url
+                self._intervals[slot] = interval
+            else:
+                slot = len(self._urls)
+                self._urls.append(url)
+                self._intervals.append(interval)
+                self._generations.append(0)
+            self._slots[url] = slot
+        else:
+            # invalidate the pending timer, the new interval starts from a fresh phase
+            self._generations[slot] = (self._generations[slot] + 1) & 0xFFFFFFFF
+            self._intervals[slot] = interval
+        self._schedule(slot, random.uniform(0, interval))
+
+    def register(self, url: str, interval: int) -> None:
+        if self._wheel is None:
+            raise RuntimeError("Scheduler not started")
+        self._add(url, interval)
+        if self._store:
+            self._store.register(url, interval)
+        log.info("Registered monitor", extra={"url": url, "interval": interval})
+
+    def unregister(self, url: str) -> bool:
+        slot = self._slots.pop(url, None)
+        if slot is None:
+            return False
+        self._generations[slot] = (self._generations[slot] + 1) & 0xFFFFFFFF
+        self._urls[slot] = None
+        self._free.append(slot)
+        if self._store:
+            self._store.unregister(url)
+        log.info("Unregistered monitor", extra={"url": url})
+        return True
+
+    async def start(self) -> None:
+        self._started_at = self._loop.time()
+        self._wheel = TimerWheel()
+        if self._store:
+            monitors = self._store.load()
+            for url, interval in monitors.items():
+                self._add(url, interval)
+            self._store.compact(monitors.items())
+            log.info(f"Restored {len(monitors)} monitors")
+        self._backlog = asyncio.Queue(maxsize=self._backlog_size)
+        self._publishers = [self._loop.create_task(self._publish_backlog()) for _ in range(self._publisher_count)]
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        for publisher in self._publishers:
+            publisher.cancel()
+        await asyncio.gather(*self._publishers, return_exceptions=True)
+        if self._store:
+            self._store.close()
+
+    def _fire(self, packed: int) -> None:
+        slot = packed & _INDEX_MASK
+        if packed >> _INDEX_BITS != self._generations[slot] or self._urls[slot] is None:
+            return
+
+        interval = self._intervals[slot]
+        self._schedule(slot, interval + random.uniform(-self._jitter, self._jitter) * interval)
+        try:
+            self._backlog.put_nowait(self._urls[slot])
+        except asyncio.QueueFull:
+            self.skipped += 1
+            log.warning("Monitor backlog full, skipping check", extra={"url": self._urls[slot]})
+
+    async def _publish_backlog(self) -> None:
+        while True:
+            url = await self._backlog.get()
+            try:
+                await self._publish(url)
+            except Exception as e:
+                log.exception(f"Failed to queue monitored url: {e}", extra={"url": url})
+            finally:
+                self._backlog.task_done()
+
+    async def main_loop(self):
+        while not self._stopped:
+            for packed in self._wheel.advance(self._now()):
+                self._fire(packed)
+            await asyncio.sleep(self._tick)
+
+    async def received_message(self, message: IncomingMessage) -> None:
+        """ AMQP hook for monitor (un)registrations sent by the producer """
+
+        try:
+            action = message.headers.get("action")
+            body = json.loads(message.body.decode("utf8"))
+            if action == "register":
+                self.register(body["url"], int(body["interval"]))
+            elif action == "unregister":
+                self.unregister(body["url"])
+            else:
+                raise ValueError(f"unknown action {action}")
+        except (JSONDecodeError, UnicodeDecodeError, KeyError, TypeError, ValueError) as e:
+            log.error(f"Received malformed monitor message, raw: {message.body}. {e.__class__.__name__}: {str(e)}. "
+                      f"Rejecting without requeuing")
+            message.reject(requeue=False)
+            return
+        message.ack()
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import logging
+import signal
+import sys
+from asyncio import AbstractEventLoop
+from uuid import uuid4
+
+import functools
+import uvloop
+
+from fm_url_checker.consumer.amqp.models import ConnectionArgs, QueueInfo
+from fm_url_checker.consumer.amqp.worker import Worker, BaseWorker
+from fm_url_checker.consumer.run import shutdown, stop_on_failure, exit_code
+from fm_url_checker.scheduler import settings
+from fm_url_checker.scheduler.monitor import MonitorScheduler
+from fm_url_checker.scheduler.store import MonitorStore
+
+log = logging.getLogger(__name__)
+
+
+async def startup(worker: BaseWorker, scheduler: MonitorScheduler) -> None:
+    await worker.start()
+    await scheduler.start()
+    await worker.register_queue(QueueInfo(name=settings.RABBITMQ_MONITOR_QUEUE), scheduler.received_message)
+
+
+def create_scheduler(worker: BaseWorker, loop: AbstractEventLoop) -> MonitorScheduler:
+    """ Scheduler publishing the monitor checks as jobs through the worker """
+
+    async def push_job(url: str) -> None:
+        await worker.publish(routing_key=settings.RABBITMQ_JOB_ROUTING_KEY,
+                             exchange=settings.RABBITMQ_JOB_EXCHANGE,
+                             body=json.dumps({"url": url}).encode("utf8"),
+                             headers={"job_id": uuid4().hex})
+
+    return MonitorScheduler(publish=push_job,
+                            store=MonitorStore(settings.SCHEDULER_STORE_PATH),
+                            tick=settings.SCHEDULER_TICK,
+                            jitter=settings.SCHEDULER_JITTER,
+                            publishers=settings.SCHEDULER_PUBLISHERS,
+                            backlog=settings.SCHEDULER_BACKLOG,
+                            loop=loop)
+
+
+def run():
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    loop = asyncio.get_event_loop()
+
+    worker = Worker(connection_args=ConnectionArgs(host=settings.RABBITMQ_HOST,
+                                                   port=settings.RABBITMQ_PORT,
+                                                   login=settings.RABBITMQ_USER,
+                                                   password=settings.RABBITMQ_PASS,
+                                                   virtualhost=settings.RABBITMQ_VHOST),
+                    prefetch_count=100,
+                    startup_timeout=settings.RABBITMQ_STARTUP_TIMEOUT,
+                    probe_max_delay=settings.RABBITMQ_PROBE_MAX_DELAY,
+                    reconnect_delay=settings.RABBITMQ_RECONNECT_DELAY,
+                    loop=loop)
+
+    scheduler = create_scheduler(worker, loop)
+
+    for sig in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig,
+                                functools.partial(shutdown, loop, sig, worker.stop, scheduler.stop))
+
+    startup_task = loop.create_task(startup(worker, scheduler))
+    startup_task.add_done_callback(functools.partial(stop_on_failure, loop))
+
+    loop.run_forever()
+    sys.exit(exit_code(startup_task))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,34 @@
+import logging
+
+import os
+
+# noinspection PyUnresolvedReferences
+from . import logging_config
+
+log = logging.getLogger(__name__)
+
+NAME = "scheduler:monitors"
+
+DEBUG = (os.getenv("FM_DEBUG", "false").lower() in ("y", "yes", "t", "true"))
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
+RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5762"))
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "rabbitmq")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "rabbitmq")
+RABBITMQ_VHOST = os.getenv("RABBITMQ_VHOST", "/")
+RABBITMQ_JOB_EXCHANGE = os.getenv("RABBITMQ_JOB_EXCHANGE", "")
+RABBITMQ_JOB_ROUTING_KEY = os.getenv("RABBITMQ_JOB_ROUTING_KEY", "jobs")
+RABBITMQ_MONITOR_QUEUE = os.getenv("RABBITMQ_MONITOR_QUEUE", "monitors")
+RABBITMQ_STARTUP_TIMEOUT = float(os.getenv("RABBITMQ_STARTUP_TIMEOUT", "60"))
+RABBITMQ_PROBE_MAX_DELAY = float(os.getenv("RABBITMQ_PROBE_MAX_DELAY", "5"))
+RABBITMQ_RECONNECT_DELAY = float(os.getenv("RABBITMQ_RECONNECT_DELAY", "1"))
+
+SCHEDULER_STORE_PATH = os.getenv("SCHEDULER_STORE_PATH", "monitors.journal")
+SCHEDULER_TICK = float(os.getenv("SCHEDULER_TICK", "1"))
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.05"))
+# Concurrent publishes of due checks and the checks that may wait for one, see monitor.MonitorScheduler
+SCHEDULER_PUBLISHERS = int(os.getenv("SCHEDULER_PUBLISHERS", "8"))
+SCHEDULER_BACKLOG = int(os.getenv("SCHEDULER_BACKLOG", "10000"))
+
+if DEBUG:
+    logging.getLogger("").setLevel("DEBUG")
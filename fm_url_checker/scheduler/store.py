@@ -0,0 +1,67 @@
+import logging
+import os
+from typing import Dict, Iterable, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class MonitorStore:
+    """
+    Append-only journal of monitor registrations.
+
+    Every change is a single line, `R<tab>interval<tab>url` to register and `U<tab>url` to unregister. The journal is
+    replayed on load and rewritten as a snapshot by `compact`, so it only grows with the changes since the last start.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file = None
+
+    def load(self) -> Dict[str, int]:
+        monitors: Dict[str, int] = {}
+        if not os.path.exists(self._path):
+            return monitors
+
+        with open(self._path, encoding="utf8") as journal:
+            for line_no, line in enumerate(journal, start=1):
+                parts = line.rstrip("\n").split("\t")
+                try:
+                    if parts[0] == "R":
+                        monitors[parts[2]] = int(parts[1])
+                    elif parts[0] == "U":
+                        monitors.pop(parts[1], None)
+                    else:
+                        raise ValueError(f"unknown record type {parts[0]}")
+                except (IndexError, ValueError) as e:
+                    # a crash mid-write can only truncate the last line
+                    log.warning(f"Skipping malformed journal line {line_no}: {e}")
+        return monitors
+
+    def compact(self, monitors: Iterable[Tuple[str, int]]) -> None:
+        """ Atomically replaces the journal with a snapshot of the given registrations """
+
+        self.close()
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as snapshot:
+            for url, interval in monitors:
+                snapshot.write(f"R\t{interval}\t{url}\n")
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(tmp_path, self._path)
+
+    def _append(self, line: str) -> None:
+        if self._file is None:
+            self._file = open(self._path, "a", encoding="utf8")
+        self._file.write(line)
+        self._file.flush()
+
+    def register(self, url: str, interval: int) -> None:
+        self._append(f"R\t{interval}\t{url}\n")
+
+    def unregister(self, url: str) -> None:
+        self._append(f"U\t{url}\n")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
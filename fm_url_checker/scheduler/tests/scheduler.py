@@ -0,0 +1,172 @@
+import asyncio
+import json
+import random
+
+import pytest
+from flexmock import flexmock
+
+from fm_url_checker.consumer.amqp import worker as amqp_worker
+from fm_url_checker.consumer.amqp.models import ConnectionArgs
+from fm_url_checker.consumer.tests.consumer import FakeIncomingMessage, FakeRobustConnection
+from fm_url_checker.scheduler import run as scheduler_run, settings
+from fm_url_checker.scheduler.monitor import MonitorScheduler
+from fm_url_checker.scheduler.store import MonitorStore
+from fm_url_checker.scheduler.timer_wheel import TimerWheel
+
+
+@pytest.mark.scheduler
+class TestTimerWheel:
+    def test_expiry(self):
+        wheel = TimerWheel(slots=4, levels=3, start=5)
+        # covers all levels and the overflow past the 64 tick horizon
+        dues = {value: random.randint(0, 300) for value in range(2000)}
+        for value, due in dues.items():
+            wheel.add(due, value)
+        assert len(wheel) == len(dues), "wrong wheel size"
+
+        fired = {}
+        for tick in range(6, 301):
+            for value in wheel.advance(tick):
+                fired[value] = tick
+
+        assert len(wheel) == 0, "entries left in the wheel"
+        assert all(fired[value] == max(due, 6) for value, due in dues.items()), "entries fired at the wrong tick"
+
+    def test_invalid_slots(self):
+        with pytest.raises(ValueError):
+            TimerWheel(slots=10)
+
+
+@pytest.mark.scheduler
+class TestMonitorStore:
+    def test_journal(self, tmp_path):
+        store = MonitorStore(str(tmp_path / "monitors.journal"))
+        store.register("http://a.com", 60)
+        store.register("http://b.com", 60)
+        store.register("http://a.com", 120)
+        store.unregister("http://b.com")
+        store.close()
+
+        assert store.load() == {"http://a.com": 120}, "journal replayed incorrectly"
+
+        store.compact(store.load().items())
+        assert store.load() == {"http://a.com": 120}, "snapshot lost registrations"
+
+    def test_truncated_journal(self, tmp_path):
+        path = tmp_path / "monitors.journal"
+        path.write_text("R\t60\thttp://a.com\nR\t6")
+        assert MonitorStore(str(path)).load() == {"http://a.com": 60}, "truncated line not skipped"
+
+
+@pytest.mark.scheduler
+@pytest.mark.asyncio
+class TestMonitorScheduler:
+    async def test_schedule(self, tmp_path):
+        published = []
+
+        async def publish(url):
+            published.append(url)
+
+        store = MonitorStore(str(tmp_path / "monitors.journal"))
+        scheduler = MonitorScheduler(publish=publish, store=store, tick=0.01, jitter=0)
+        await scheduler.start()
+        scheduler.register("http://a.com", 1)
+        scheduler.register("http://b.com", 1)
+        # first check lands at a random phase within the interval
+        await asyncio.sleep(1.1)
+        assert len(scheduler) == 2, "wrong number of monitors"
+        assert set(published) == {"http://a.com", "http://b.com"}, "monitors not queued"
+        assert len(published) <= 4, "monitors queued too often"
+
+        assert scheduler.unregister("http://b.com"), "monitor not removed"
+        assert not scheduler.unregister("http://b.com"), "monitor removed twice"
+        published.clear()
+        await asyncio.sleep(1.1)
+        await scheduler.stop()
+        assert published and set(published) == {"http://a.com"}, "removed monitor still queued"
+
+        restored = MonitorScheduler(publish=publish, store=MonitorStore(store._path), tick=0.01)
+        await restored.start()
+        await restored.stop()
+        assert len(restored) == 1, "monitors not restored"
+
+    async def test_received_message(self):
+        async def publish(url):
+            pass
+
+        scheduler = MonitorScheduler(publish=publish)
+        await scheduler.start()
+
+        message = FakeIncomingMessage(headers={"action": "register"}, body_dict={"url": "http://a.com", "interval": 60})
+        await scheduler.received_message(message)
+        assert message.ack_called and len(scheduler) == 1, "registration not applied"
+
+        message = FakeIncomingMessage(headers={"action": "unregister"}, body_dict={"url": "http://a.com"})
+        await scheduler.received_message(message)
+        assert message.ack_called and len(scheduler) == 0, "removal not applied"
+
+        message = FakeIncomingMessage(headers={"action": "register"}, body_dict={"url": "http://a.com"})
+        await scheduler.received_message(message)
+        assert message.reject_called, "malformed registration not rejected"
+
+        await scheduler.stop()
+
+    async def test_fire_through_worker(self, tmp_path):
+        connections = []
+
+        async def connect_robust(**kwargs):
+            connections.append(FakeRobustConnection())
+            return connections[-1]
+
+        async def broker_available(*args, **kwargs):
+            return 0
+
+        flexmock(amqp_worker, wait_for_broker=broker_available)
+        flexmock(amqp_worker.aio_pika, connect_robust=connect_robust)
+        flexmock(settings, SCHEDULER_STORE_PATH=str(tmp_path / "monitors.journal"))
+
+        worker = amqp_worker.Worker(ConnectionArgs())
+        scheduler = scheduler_run.create_scheduler(worker, asyncio.get_event_loop())
+        await scheduler_run.startup(worker, scheduler)
+        scheduler.register("http://a.com", 60)
+
+        slot = scheduler._slots["http://a.com"]
+        scheduler._fire(scheduler._generations[slot] << 32 | slot)
+        await scheduler._backlog.join()
+        await scheduler.stop()
+        await worker.stop()
+
+        assert len(connections) == 1, "worker connected twice"
+        assert connections[0].channels[1].consumers == [settings.RABBITMQ_MONITOR_QUEUE], "monitors not consumed"
+        published = connections[0].channels[0].default_exchange.published
+        assert [(routing_key, json.loads(message.body)) for routing_key, message in published] == [
+            (settings.RABBITMQ_JOB_ROUTING_KEY, {"url": "http://a.com"})], "monitor check not queued"
+
+    async def test_slow_publish(self):
+        published = []
+        release = asyncio.Event()
+
+        async def publish(url):
+            if url == "http://slow.com":
+                await release.wait()
+            published.append(url)
+
+        scheduler = MonitorScheduler(publish=publish, tick=0.01, jitter=0, publishers=2, backlog=1)
+        await scheduler.start()
+        for url in ("http://slow.com", "http://a.com", "http://b.com"):
+            scheduler.register(url, 60)
+        slots = [scheduler._slots[url] for url in ("http://slow.com", "http://a.com", "http://b.com")]
+        for slot in slots[:2]:
+            scheduler._fire(scheduler._generations[slot] << 32 | slot)
+            await asyncio.sleep(0.02)
+        assert published == ["http://a.com"], "a slow publish held back the others"
+
+        scheduler._fire(scheduler._generations[slots[2]] << 32 | slots[2])
+        scheduler._fire(scheduler._generations[slots[2]] << 32 | slots[2])
+        assert scheduler.skipped == 1, "check over the backlog not skipped"
+        assert scheduler._wheel.current > 0, "tick loop stalled"
+
+        release.set()
+        await scheduler._backlog.join()
+        await scheduler.stop()
+        assert sorted(published) == ["http://a.com", "http://b.com", "http://slow.com"]
@@ -0,0 +1,77 @@
+from array import array
+from typing import List
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel keyed on integer ticks.
+
+    Every level has `slots` buckets, an entry is stored in the lowest level whose higher digits match the current
+    tick and is cascaded down a level each time that level's slot comes round. Entries are (due, value) pairs packed
+    into a flat unsigned 64bit array per bucket, which keeps the per-entry overhead at 16 bytes.
+    """
+
+    def __init__(self, slots: int = 64, levels: int = 4, start: int = 0):
+        if slots < 2 or slots & (slots - 1):
+            raise ValueError("Number of slots must be a power of two")
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._levels = levels
+        self._wheels: List[List[array]] = [[array("Q") for _ in range(slots)] for _ in range(levels)]
+        self._overflow = array("Q")
+        self._current = start
+        self._size = 0
+
+    @property
+    def current(self) -> int:
+        return self._current
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, due: int, value: int) -> None:
+        """ Schedule value to expire at tick `due`, ticks in the past expire on the next advance """
+
+        self._place(max(due, self._current + 1), value)
+        self._size += 1
+
+    def _place(self, due: int, value: int) -> None:
+        for level in range(self._levels):
+            shift = self._bits * (level + 1)
+            if due >> shift == self._current >> shift:
+                self._wheels[level][(due >> (self._bits * level)) & self._mask].extend((due, value))
+                return
+        self._overflow.extend((due, value))
+
+    def _cascade(self, bucket: array) -> None:
+        for i in range(0, len(bucket), 2):
+            self._place(bucket[i], bucket[i + 1])
+
+    def advance(self, to: int) -> List[int]:
+        """ Moves the wheel up to tick `to` (inclusive), returns the values that expired on the way """
+
+        expired = []
+        while self._current < to:
+            self._current += 1
+            tick = self._current
+
+            if tick & ((1 << (self._bits * self._levels)) - 1) == 0 and self._overflow:
+                bucket, self._overflow = self._overflow, array("Q")
+                self._cascade(bucket)
+
+            for level in range(self._levels - 1, 0, -1):
+                if tick & ((1 << (self._bits * level)) - 1) == 0:
+                    wheel = self._wheels[level]
+                    index = (tick >> (self._bits * level)) & self._mask
+                    if wheel[index]:
+                        bucket, wheel[index] = wheel[index], array("Q")
+                        self._cascade(bucket)
+
+            wheel = self._wheels[0]
+            index = tick & self._mask
+            if wheel[index]:
+                bucket, wheel[index] = wheel[index], array("Q")
+                expired.extend(bucket[1::2])
+
+        self._size -= len(expired)
+        return expired